@@ -0,0 +1,133 @@
+import sys
+from collections import Counter
+import storage
+from storage import assessment_id
+
+ASSESSOR_TYPES = ("Self", "Peer", "Manager")
+
+# Per-user materialized view over approved assessments:
+# {"sums": {crit: total}, "counts": {crit: n}, "tomo_sums": {comp: total},
+#  "tomo_counts": {comp: n}, "assessors": {type: n}, "approved": n}
+def empty_aggregate():
+    return {"sums": {}, "counts": {}, "tomo_sums": {}, "tomo_counts": {},
+            "assessors": {t: 0 for t in ASSESSOR_TYPES}, "approved": 0}
+
+def is_approved(assess):
+    return assess.get('status', 'Approved') == 'Approved'
+
+def _add_scores(sums, counts, scores, sign):
+    for key, score in scores.items():
+        sums[key] = sums.get(key, 0) + sign * score
+        counts[key] = counts.get(key, 0) + sign
+        if counts[key] == 0:
+            del sums[key]
+            del counts[key]
+
+def add_assessment(agg, assess, sign=1):
+    _add_scores(agg["sums"], agg["counts"], assess.get('scores', {}), sign)
+    _add_scores(agg["tomo_sums"], agg["tomo_counts"], assess.get('tomo_scores', {}), sign)
+    assessor = assess.get('assessor')
+    agg["assessors"][assessor] = agg["assessors"].get(assessor, 0) + sign
+    agg["approved"] += sign
+
+# Adds (or with sign=-1 takes away) another aggregate, such as a stored rollup
+def add_aggregate(agg, part, sign=1):
+    for sums, counts in (("sums", "counts"), ("tomo_sums", "tomo_counts")):
+        for key, value in part[sums].items():
+            agg[sums][key] = agg[sums].get(key, 0) + sign * value
+            agg[counts][key] = agg[counts].get(key, 0) + sign * part[counts][key]
+            if agg[counts][key] == 0:
+                del agg[sums][key]
+                del agg[counts][key]
+    for assessor, n in part["assessors"].items():
+        agg["assessors"][assessor] = agg["assessors"].get(assessor, 0) + sign * n
+    agg["approved"] += sign * part["approved"]
+
+def user_aggregate(assessments):
+    agg = empty_aggregate()
+    for assess in assessments:
+        if is_approved(assess):
+            add_assessment(agg, assess)
+    return agg
+
+def build(data):
+    aggs = {}
+    for user, assessments in data.items():
+        agg = user_aggregate(assessments)
+        if agg["approved"]:
+            aggs[user] = agg
+    return aggs
+
+def copy_aggregate(agg):
+    return {"sums": dict(agg["sums"]), "counts": dict(agg["counts"]),
+            "tomo_sums": dict(agg["tomo_sums"]), "tomo_counts": dict(agg["tomo_counts"]),
+            "assessors": dict(agg["assessors"]), "approved": agg["approved"]}
+
+def update(aggs, user, before, after):
+    # Only the approved entries that entered or left this user's list are touched
+    old = Counter(assessment_id(a) for a in before if is_approved(a))
+    new = Counter(assessment_id(a) for a in after if is_approved(a))
+    if old == new:
+        return
+    by_id = {assessment_id(a): a for a in (*before, *after)}
+    agg = copy_aggregate(aggs[user]) if user in aggs else empty_aggregate()
+    for aid, n in (old - new).items():
+        for _ in range(n):
+            add_assessment(agg, by_id[aid], -1)
+    for aid, n in (new - old).items():
+        for _ in range(n):
+            add_assessment(agg, by_id[aid])
+    if agg["approved"]:
+        aggs[user] = agg
+    else:
+        aggs.pop(user, None)
+
+storage.register_view("aggregates", build, update)
+
+# Per-user {status: n}, the other cheap view the dashboards need
+def count_statuses(assessments):
+    counts = {}
+    for assess in assessments:
+        status = assess.get('status', 'Approved')
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+def build_status_counts(data):
+    return {user: count_statuses(assessments) for user, assessments in data.items()}
+
+def update_status_counts(counts, user, before, after):
+    if after:
+        counts[user] = count_statuses(after)
+    else:
+        counts.pop(user, None)
+
+storage.register_view("status_counts", build_status_counts, update_status_counts)
+
+def averages(agg):
+    return {crit: agg["sums"][crit] / agg["counts"][crit] for crit in agg["sums"]}
+
+def tomo_averages(agg):
+    return {comp: agg["tomo_sums"][comp] / agg["tomo_counts"][comp] for comp in agg["tomo_sums"]}
+
+def overall_average(agg):
+    avgs = averages(agg)
+    return sum(avgs.values()) / len(avgs) if avgs else 0
+
+def normalize(agg):
+    return {"sums": dict(agg["sums"]), "counts": dict(agg["counts"]), "approved": agg["approved"],
+            "tomo_sums": dict(agg["tomo_sums"]), "tomo_counts": dict(agg["tomo_counts"]),
+            "assessors": {t: n for t, n in agg["assessors"].items() if n}}
+
+def diff(stored, expected):
+    drift = []
+    for user in sorted(set(stored) | set(expected)):
+        s = normalize(stored[user]) if user in stored else None
+        e = normalize(expected[user]) if user in expected else None
+        if s != e:
+            drift.append((user, s, e))
+    return drift
+
+if __name__ == "__main__":
+    # python aggregates.py verify|rebuild
+    from repository import view_cli
+    view_cli("aggregates", sys.argv)
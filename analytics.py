@@ -0,0 +1,101 @@
+import threading
+import numpy as np
+import pandas as pd
+import diagnostics
+from constants import TOMO_COMPONENTS
+from storage import assessment_id
+
+BASE_COLUMNS = ("user", "id", "assessor", "role", "status", "timestamp", "tomo")
+
+# One frame per repository, rebuilt only when the repository's data version moves.
+# Results computed from a frame are memoized alongside it.
+_frames = {}
+_frames_lock = threading.Lock()
+
+def build_frame(data, users=None):
+    columns = {name: [] for name in BASE_COLUMNS}
+    criteria = {}
+    tomo = {comp: [] for comp in TOMO_COMPONENTS}
+    n = 0
+    for user, assessments in data.items():
+        if users is not None and user not in users:
+            continue
+        for assess in assessments:
+            columns["user"].append(user)
+            columns["id"].append(assessment_id(assess))
+            columns["assessor"].append(assess.get('assessor'))
+            columns["role"].append(assess.get('role'))
+            columns["status"].append(assess.get('status', 'Approved'))
+            columns["timestamp"].append(assess.get('timestamp'))
+            columns["tomo"].append(assess.get('tomo', np.nan))
+            scores = assess.get('scores', {})
+            for crit in scores:
+                if crit not in criteria:
+                    criteria[crit] = [np.nan] * n
+            for crit, values in criteria.items():
+                values.append(scores.get(crit, np.nan))
+            tomo_scores = assess.get('tomo_scores', {})
+            for comp in TOMO_COMPONENTS:
+                tomo[comp].append(tomo_scores.get(comp, np.nan))
+            n += 1
+    frame = pd.DataFrame(columns)
+    for name in ("user", "assessor", "role", "status"):
+        frame[name] = frame[name].astype("category")
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], errors="coerce")
+    frame["tomo"] = np.asarray(columns["tomo"], dtype=float)
+    for crit, values in criteria.items():
+        frame[crit] = np.asarray(values, dtype=float)
+    for comp in TOMO_COMPONENTS:
+        frame[f"tomo_{comp}"] = np.asarray(tomo[comp], dtype=float)
+    frame.attrs["criteria"] = list(criteria)
+    return frame
+
+def _org_users(repo):
+    return {u for u in repo.load_users() if u != 'sadmin'}
+
+def _entry(repo):
+    version = repo.data_version()
+    entry = _frames.get(id(repo))
+    if entry is None or entry["version"] != version:
+        diagnostics.count("frame_cache:miss")
+        with diagnostics.span("build_frame"):
+            frame = build_frame(repo.load_assessments(), _org_users(repo))
+        entry = {"version": version, "frame": frame, "results": {}}
+        with _frames_lock:
+            _frames[id(repo)] = entry
+    else:
+        diagnostics.count("frame_cache:hit")
+    return entry
+
+def _memo(repo, name, compute):
+    entry = _entry(repo)
+    if name not in entry["results"]:
+        entry["results"][name] = compute(entry["frame"])
+    return entry["results"][name]
+
+def criteria_columns(frame):
+    return frame.attrs.get("criteria", [])
+
+def approved(frame):
+    return frame[frame["status"] == "Approved"]
+
+def role_means(repo):
+    return _memo(repo, "role_means", lambda f: approved(f).groupby("role", observed=True)[criteria_columns(f)].mean())
+
+def criterion_means(repo):
+    return _memo(repo, "criterion_means", lambda f: approved(f)[criteria_columns(f)].mean())
+
+def score_distribution(repo, low=1, high=5):
+    def compute(f):
+        scores = approved(f)[criteria_columns(f)]
+        dist = {}
+        for crit in scores.columns:
+            values = scores[crit].dropna().to_numpy(dtype=int)
+            values = values[(values >= low) & (values <= high)]
+            dist[crit] = np.bincount(values - low, minlength=high - low + 1)
+        return pd.DataFrame(dist, index=range(low, high + 1))
+    return _memo(repo, "score_distribution", compute)
+
+def assessor_breakdown(repo):
+    return _memo(repo, "assessor_breakdown",
+                 lambda f: f.groupby(["assessor", "status"], observed=True).size().unstack(fill_value=0))
@@ -0,0 +1,258 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+import sys
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+import diagnostics
+import hierarchy
+import transfer
+from aggregates import averages, overall_average, tomo_averages, normalize
+from storage import thaw, new_assessment_id
+from repository import get_repository
+
+# Read-mostly JSON API over the same repository the Streamlit app uses:
+#   GET  /stats                              org-wide status counts
+#   GET  /users/<user>/aggregate             approved-score aggregate
+#   GET  /managers/<manager>/pending         pending queue (?org=1 for the whole subtree)
+#   GET  /managers/<manager>/stats           rolled-up stats for the manager's org
+#   POST /users/<user>/assessments           submit an assessment
+# GETs carry an ETag from the repository's data version and answer
+# If-None-Match with 304. Lists take offset/limit.
+HOST = os.environ.get("PEAKDESIGNER_API_HOST", "127.0.0.1")
+PORT = int(os.environ.get("PEAKDESIGNER_API_PORT", 8502))
+TOKEN = os.environ.get("PEAKDESIGNER_API_TOKEN")
+WORKERS = int(os.environ.get("PEAKDESIGNER_API_WORKERS", 16))
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+MAX_BODY = 64 * 1024
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def etag(version):
+    return 'W/"' + hashlib.md5(repr(version).encode("utf-8")).hexdigest() + '"'
+
+def page_params(query):
+    try:
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", [str(DEFAULT_LIMIT)])[0])
+    except ValueError:
+        raise ApiError(400, "offset and limit must be integers")
+    if offset < 0 or not 0 < limit <= MAX_LIMIT:
+        raise ApiError(400, f"offset must be >= 0 and limit between 1 and {MAX_LIMIT}")
+    return offset, limit
+
+def page(items, total, offset, limit):
+    return {"total": total, "offset": offset, "limit": limit, "items": items}
+
+def known_user(repo, user):
+    if user not in repo.load_users() or user == 'sadmin':
+        raise ApiError(404, f"unknown user {user!r}")
+
+def get_stats(repo, query):
+    users = repo.load_users()
+    return {"status_counts": repo.status_counts(),
+            "users": len([u for u in users if u != 'sadmin']),
+            "managers": len([u for u in users if users[u].get("role") == "Manager"])}
+
+def get_aggregate(repo, query, user):
+    known_user(repo, user)
+    agg = repo.user_aggregate(user)
+    if not agg:
+        return {"user": user, "approved": 0, "averages": {}, "overall": None, "tomo_averages": {}}
+    return {"user": user, "approved": agg["approved"], "averages": averages(agg), "overall": overall_average(agg),
+            "tomo_averages": tomo_averages(agg), "aggregate": normalize(agg)}
+
+def _members(repo, manager, query):
+    known_user(repo, manager)
+    org = repo.hierarchy()
+    if query.get("org", ["0"])[0] in ("1", "true"):
+        return sorted(hierarchy.subtree(org, manager))
+    return list(hierarchy.direct_reports(org, manager))
+
+def get_pending(repo, query, manager):
+    offset, limit = page_params(query)
+    pending = repo.pending_assessments(_members(repo, manager, query))
+    items = [{"user": user, **thaw(assess)} for user, assess in pending[offset:offset + limit]]
+    return page(items, len(pending), offset, limit)
+
+def get_manager_stats(repo, query, manager):
+    known_user(repo, manager)
+    total = hierarchy.org_rollup(repo, manager)
+    teams = hierarchy.sub_team_rollups(repo, manager)
+    summary = lambda r: {"members": r["members"], "approved": r["approved"], "pending": r["pending"],
+                         "overall": overall_average(r) if r["sums"] else None,
+                         "averages": averages(r), "tomo_averages": tomo_averages(r)}
+    return {"manager": manager, "org": summary(total), "sub_teams": {lead: summary(r) for lead, r in teams.items()}}
+
+# The body is an assessment as stored: assessor, optional assessor_name and
+# id, role, scores, tomo_scores. Validation is the importer's, so the API
+# accepts exactly what an import would.
+def post_assessment(repo, query, user, body):
+    known_user(repo, user)
+    if not isinstance(body, dict):
+        raise ApiError(400, "body must be a JSON object")
+    # parse_row expects CSV strings; anything else would be stored as given
+    for field in ("id", "assessor_name", "timestamp"):
+        if body.get(field) is not None and not isinstance(body[field], str):
+            raise ApiError(400, f"{field} must be a string")
+    if body.get("assessor") == "Self":
+        has_self = any(a.get('assessor') == "Self" and a.get('status', 'Approved') == 'Approved'
+                       for a in repo.user_assessments(user))
+        status = "Pending Approval" if has_self else "Approved"
+    else:
+        status = "Pending Approval"
+    row = {"user": user, "id": body.get("id") or new_assessment_id(), "assessor": body.get("assessor"),
+           "assessor_name": body.get("assessor_name"), "role": body.get("role"), "status": status,
+           "timestamp": body.get("timestamp") or datetime.now().isoformat()}
+    scores, tomo_scores = body.get("scores") or {}, body.get("tomo_scores") or {}
+    if not isinstance(scores, dict) or not isinstance(tomo_scores, dict):
+        raise ApiError(400, "scores and tomo_scores must be objects")
+    row.update(scores)
+    row.update({f"tomo_{comp}": score for comp, score in tomo_scores.items()})
+    unknown = [c for c in scores if c not in transfer.ALL_CRITERIA]
+    unknown += [c for c in tomo_scores if f"tomo_{c}" not in transfer.TOMO_COLUMNS]
+    if unknown:
+        raise ApiError(400, f"unknown scores: {', '.join(sorted(unknown))}")
+    try:
+        user, assess = transfer.parse_row(row, repo.load_users())
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    ok, message = repo.submit(user, assess)
+    if not ok:
+        raise ApiError(409, message)
+    return 201, {"user": user, "id": assess["id"], "status": assess["status"]}
+
+ROUTES = [
+    ("GET", re.compile(r"^/stats$"), get_stats),
+    ("GET", re.compile(r"^/users/([^/]+)/aggregate$"), get_aggregate),
+    ("GET", re.compile(r"^/managers/([^/]+)/pending$"), get_pending),
+    ("GET", re.compile(r"^/managers/([^/]+)/stats$"), get_manager_stats),
+    ("POST", re.compile(r"^/users/([^/]+)/assessments$"), post_assessment),
+]
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "peakdesigner-api"
+
+    def log_message(self, format, *args):
+        if os.environ.get("PEAKDESIGNER_API_LOG"):
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, default=thaw).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if not TOKEN:
+            return True
+        return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {TOKEN}")
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        allowed = []
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed.append(route_method)
+                continue
+            with diagnostics.span(f"api:{handler.__name__}"):
+                self.handle_route(method, handler, query, [unquote(p) for p in match.groups()])
+            return
+        if allowed:
+            self.send_json(405, {"error": "method not allowed"}, [("Allow", ", ".join(allowed))])
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def handle_route(self, method, handler, query, args):
+        if not self.authorized():
+            self.send_json(401, {"error": "missing or wrong bearer token"}, [("WWW-Authenticate", "Bearer")])
+            return
+        repo = get_repository()
+        try:
+            if method == "GET":
+                # The version is taken before the read, so a write racing this
+                # request can only make the tag look older than the body
+                tag = etag(repo.data_version())
+                if tag in (t.strip() for t in self.headers.get("If-None-Match", "").split(",")):
+                    self.send_json(304, None, [("ETag", tag)])
+                    return
+                self.send_json(200, handler(repo, query, *args), [("ETag", tag), ("Cache-Control", "no-cache")])
+            else:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_BODY:
+                    raise ApiError(413, "body too large")
+                try:
+                    body = json.loads(self.rfile.read(length) or b"null")
+                except ValueError:
+                    raise ApiError(400, "body must be JSON")
+                status, payload = handler(repo, query, *args, body)
+                self.send_json(status, payload)
+        except ApiError as e:
+            self.send_json(e.status, {"error": str(e)})
+        except Exception:
+            # The traceback goes to stderr; the client still gets an answer
+            # rather than a dropped connection
+            traceback.print_exc()
+            self.send_json(500, {"error": "internal server error"})
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+# A fixed pool rather than a thread per request, so per-thread resources such
+# as SQLite connections are reused across requests
+class PooledHTTPServer(HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler=Handler, workers=WORKERS):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+def serve(host=HOST, port=PORT):
+    server = PooledHTTPServer((host, port))
+    print(f"Serving the peakdesigner API on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    # python api.py [host] [port]
+    serve(sys.argv[1] if len(sys.argv) > 1 else HOST, int(sys.argv[2]) if len(sys.argv) > 2 else PORT)
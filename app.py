@@ -1,107 +1,36 @@
 import streamlit as st
-import json
-import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 import hashlib
-import pandas as pd
-
-# Define roles, criteria, and ToMo questions (same as before)
-ROLES = [
-    "Associate Product Designer",
-    "Product Designer",
-    "Lead Product Designer",
-    "Principal Product Designer",
-    "Design Manager",
-    "Senior Design Manager",
-    "Head of Design"
-]
-
-CRITERIA = {
-    "Associate Product Designer": [
-        ("Design Craft", "Basic skills in wireframing, mockups, and UI tools."),
-        ("Research and User Understanding", "Assisting in user needs analysis and simple user journeys."),
-        ("Collaboration and Communication", "Working effectively in teams and communicating ideas clearly."),
-        ("Leadership and Mentoring", "Seeking feedback and learning from others."),
-        ("Strategic Thinking and Impact", "Contributing to meeting business goals at a basic level.")
-    ],
-    "Product Designer": [
-        ("Design Craft", "Proficient in prototyping, visual design, and design systems."),
-        ("Research and User Understanding", "Conducting user tests and gathering feedback independently."),
-        ("Collaboration and Communication", "Collaborating across teams on specs and features."),
-        ("Leadership and Mentoring", "Driving consistency in processes."),
-        ("Strategic Thinking and Impact", "Using data to shape work and evolve products based on feedback.")
-    ],
-    "Lead Product Designer": [
-        ("Design Craft", "Advanced prototyping and guiding aesthetic direction."),
-        ("Research and User Understanding", "Evaluating trends and complex UX patterns."),
-        ("Collaboration and Communication", "Reviewing goals with PMs and providing accurate timelines."),
-        ("Leadership and Mentoring", "Mentoring juniors and initiating product ideas."),
-        ("Strategic Thinking and Impact", "Prioritizing work for efficiency and business impact.")
-    ],
-    "Principal Product Designer": [
-        ("Design Craft", "Expert in complex components and user journeys."),
-        ("Research and User Understanding", "Leading strategic user research and roadmap creation."),
-        ("Collaboration and Communication", "Managing stakeholder expectations across projects."),
-        ("Leadership and Mentoring", "Improving team work through critique and leading by example."),
-        ("Strategic Thinking and Impact", "Demonstrating business thinking and high-impact delivery.")
-    ],
-    "Design Manager": [
-        ("Design Craft", "Overseeing design quality and systems across teams."),
-        ("Research and User Understanding", "Aligning research with product vision."),
-        ("Collaboration and Communication", "Facilitating cross-functional collaboration."),
-        ("Leadership and Mentoring", "Managing team development and career growth."),
-        ("Strategic Thinking and Impact", "Budget management and ensuring project success.")
-    ],
-    "Senior Design Manager": [
-        ("Design Craft", "Setting organization-wide design standards."),
-        ("Research and User Understanding", "Integrating insights into long-term strategies."),
-        ("Collaboration and Communication", "Building partnerships at senior levels."),
-        ("Leadership and Mentoring", "Coaching managers and scaling teams."),
-        ("Strategic Thinking and Impact", "Driving revenue-generating initiatives.")
-    ],
-    "Head of Design": [
-        ("Design Craft", "Defining the overall design philosophy."),
-        ("Research and User Understanding", "Championing user-centric culture."),
-        ("Collaboration and Communication", "Influencing executive decisions."),
-        ("Leadership and Mentoring", "Building and leading high-performing design org."),
-        ("Strategic Thinking and Impact", "Aligning design with company vision and growth.")
-    ]
-}
-
-SELF_TOMO_QUESTIONS = [
-    ("I continue to work in my role because the work itself is enjoyable, interesting, and stimulating. (Play)", "play"),
-    ("I continue to work in my role because I value the impact and outcomes of my work. (Purpose)", "purpose"),
-    ("I continue to work in my role because it connects to my personal growth and future goals. (Potential)", "potential"),
-    ("I continue to work in my role because I feel guilty, anxious, or ashamed if I don't. (Emotional Pressure)", "emotional"),
-    ("I continue to work in my role to gain rewards or avoid financial punishment. (Economic Pressure)", "economic"),
-    ("I continue to work in my role simply because it's routine and I don't think about why. (Inertia)", "inertia")
-]
-
-OTHER_TOMO_QUESTIONS = [
-    ("The person continues to work in their role because the work itself is enjoyable, interesting, and stimulating to them. (Play)", "play"),
-    ("The person continues to work in their role because they value the impact and outcomes of their work. (Purpose)", "purpose"),
-    ("The person continues to work in their role because it connects to their personal growth and future goals. (Potential)", "potential"),
-    ("The person continues to work in their role because they feel guilty, anxious, or ashamed if they don't. (Emotional Pressure)", "emotional"),
-    ("The person continues to work in their role to gain rewards or avoid financial punishment. (Economic Pressure)", "economic"),
-    ("The person continues to work in their role simply because it's routine and they don't think about why. (Inertia)", "inertia")
-]
-
-DATA_FILE = "assessments.json"
-USERS_FILE = "users.json"
-
-def load_data(file):
-    if os.path.exists(file):
-        with open(file, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_data(data, file):
-    with open(file, 'w') as f:
-        json.dump(data, f, indent=4)
+import io
+import os
+import tempfile
+import uuid
+import diagnostics
+from constants import ROLES, ROLE_INDEX, SELF_SLIDERS, SELF_TOMO_SLIDERS, TOMO_COMPONENTS, tomo_total
+from storage import VersionConflict, assessment_id, new_assessment_id
+from repository import VIEW_MODULES, get_repository
+from aggregates import averages as aggregate_averages, overall_average, tomo_averages
+import hierarchy
+import history
+import retention
+import tomo
+
+# pandas (and analytics, which needs it) are imported where a chart or
+# breakdown is drawn, so login and slider reruns don't pay for them
+
+PAGE_SIZES = [10, 25, 50, 100]
+# Exports from every session share one directory; files a session never got
+# round to downloading are cleared once they're this old
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "peakdesigner-exports")
+EXPORT_MAX_AGE = timedelta(hours=1)
+
+repo = get_repository()
 
 def pre_populate_users():
-    users = load_data(USERS_FILE)
+    users, version = repo.load_users_versioned()
     if not users:
+        users = {}
         # Add superadmin
         users['sadmin'] = {"password": "12345", "role": "Superadmin"}
         # Add 14 users
@@ -115,7 +44,11 @@ def pre_populate_users():
                 "title": "Product Designer",  # Default title
                 "team": [] if "Manager" in "Product Designer" else None
             }
-        save_data(users, USERS_FILE)
+        try:
+            repo.save_users(users, expected_version=version)
+        except VersionConflict:
+            # Another worker seeded the file first
+            users = repo.load_users()
     return users
 
 def is_superadmin(username):
@@ -124,11 +57,46 @@ def is_superadmin(username):
 def is_manager(role):
     return role == "Manager"
 
+@lru_cache(maxsize=4096)
 def get_masked_id(name):
     m = hashlib.md5()
     m.update(name.encode('utf-8'))
     return m.hexdigest()[:6].upper()
 
+# Older writes could append an assessment twice; actions by id only ever reach
+# the first copy, so batches and team lists keep just that one
+def first_copies(rows):
+    seen, result = set(), []
+    for uname, assess in rows:
+        key = (uname, assessment_id(assess))
+        if key not in seen:
+            seen.add(key)
+            result.append((uname, assess))
+    return result
+
+def discard_export():
+    path = st.session_state.pop("export_path", None)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def clear_stale_exports():
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = (datetime.now() - EXPORT_MAX_AGE).timestamp()
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            # Another session cleared it first
+            pass
+
+def show_bulk_results(results):
+    applied = len([r for r in results if r["ok"]])
+    st.success(f"{applied} of {len(results)} applied")
+    st.table([{"User": r["user"], "Assessment": r["id"], "Action": r["action"], "Result": r["result"]} for r in results])
+
 def add_manager():
     st.session_state["show_assign_form"] = True
     st.session_state["selected_manager"] = None
@@ -143,7 +111,7 @@ def login():
     username = st.text_input("Username")
     password = st.text_input("Password", type="password")
     if st.button("Login"):
-        users = load_data(USERS_FILE)
+        users = repo.load_users()
         if username in users and users[username]["password"] == password:
             st.session_state["logged_in"] = True
             st.session_state["username"] = username
@@ -154,10 +122,68 @@ def login():
         else:
             st.error("Invalid username or password")
 
-pre_populate_users()
+# Seeding and data checks run once per process, not on every rerun
+@st.cache_resource
+def initialize():
+    users = pre_populate_users()
+    problems = []
+    for uname, user in users.items():
+        if uname != 'sadmin' and user.get("title") not in ROLE_INDEX:
+            problems.append(f"{uname} has unknown title {user.get('title')!r}")
+        for member in user.get("team") or ():
+            if member not in users:
+                problems.append(f"{uname}'s team lists unknown user {member!r}")
+    return problems
+
+def rollup_rows(rollups):
+    rows = []
+    for lead, rollup in rollups.items():
+        row = {"Sub-team": lead, "Members": rollup["members"], "Approved": rollup["approved"],
+               "Pending": rollup["pending"], "Overall Average": round(overall_average(rollup), 2)}
+        row.update({f"ToMo {comp}": round(avg, 2) for comp, avg in tomo_averages(rollup).items()})
+        rows.append(row)
+    return rows
+
+# summaries: {label: tomo.summary(...)}, optionally with an org_percentile
+def tomo_rows(summaries, label):
+    rows = []
+    for key, summary in summaries.items():
+        if not summary["count"]:
+            continue
+        row = {label: key, "Surveys": summary["count"], "Mean ToMo": round(summary["mean"], 2), "Median": summary["median"]}
+        if summary.get("org_percentile") is not None:
+            row["Org Percentile"] = round(summary["org_percentile"])
+        row.update({comp.title(): round(avg, 2) for comp, avg in summary["components"].items() if avg is not None})
+        rows.append(row)
+    return rows
+
+def tomo_line(summary):
+    return (f"{summary['count']} approved surveys, mean ToMo {summary['mean']:.2f}, "
+            f"median {summary['median']} (middle half {summary['p25']} to {summary['p75']})")
+
+# series: {line label: {bucket: value}}; buckets sort as strings
+def trend_chart(series):
+    import pandas as pd
+    df = pd.DataFrame(series).sort_index()
+    if not df.empty:
+        st.line_chart(df)
+
+def trend_period(key):
+    return st.radio("Trend by", ["month", "quarter"], horizontal=True, key=key, format_func=str.title)
+
+def score_chart(averages):
+    import pandas as pd
+    df = pd.DataFrame.from_dict(averages, orient='index', columns=['Average Score'])
+    st.bar_chart(df)
+
+data_problems = initialize()
+rerun_started = diagnostics.start()
 
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex[:8]
+diagnostics.note_rerun(st.session_state["session_id"], st.session_state.get("username"))
 
 if not st.session_state["logged_in"]:
     login()
@@ -176,101 +202,318 @@ else:
     if is_superadmin(username):
         # Superadmin view
         st.title("Superadmin Dashboard")
-        data = load_data(DATA_FILE)
-        users = load_data(USERS_FILE)
+        for problem in data_problems:
+            st.warning(f"Startup data check: {problem}")
+        users = repo.load_users()
 
-        tabs = st.tabs(["Submission Stats", "Manage Assessments", "People"])
-        with tabs[0]:
+        tabs = st.tabs(["Submission Stats", "Manage Assessments", "People", "Archive", "Diagnostics"])
+        with tabs[0], diagnostics.span("section:submission_stats"):
             # Submission Stats
             st.subheader("Submission Stats")
-            total_submissions = sum(len(data.get(u, [])) for u in users if u != 'sadmin')
-            total_approved = sum(len([a for a in data.get(u, []) if a.get('status', 'Approved') == 'Approved']) for u in users if u != 'sadmin')
-            total_pending = sum(len([a for a in data.get(u, []) if a.get('status') == 'Pending Approval']) for u in users if u != 'sadmin')
-            total_rejected = sum(len([a for a in data.get(u, []) if a.get('status') == 'Rejected']) for u in users if u != 'sadmin')
+            counts = repo.status_counts()
+            total_submissions = sum(counts.values())
+            total_approved = counts.get('Approved', 0)
+            total_pending = counts.get('Pending Approval', 0)
+            total_rejected = counts.get('Rejected', 0)
             st.write(f"Total Submissions: {total_submissions}")
             st.write(f"Approved: {total_approved}")
             st.write(f"Pending: {total_pending}")
             st.write(f"Rejected: {total_rejected}")
 
-        with tabs[1]:
+            # Read off pre-binned histograms, so this stays cheap at any size
+            org_tomo = repo.tomo_histograms("org")
+            if tomo.totals(org_tomo).any():
+                import pandas as pd
+                st.subheader("Motivation (ToMo)")
+                st.write(tomo_line(tomo.summary(org_tomo)))
+                st.bar_chart(pd.Series(tomo.distribution(tomo.totals(org_tomo)), name="Surveys"))
+                st.write("ToMo per role")
+                st.dataframe(tomo_rows({r: tomo.summary(counts) for r, counts in sorted(repo.tomo_histograms("role").items())}, "Role"))
+                org = repo.hierarchy()
+                team_summaries = {m: tomo.team_summary(repo, hierarchy.direct_reports(org, m))
+                                  for m in sorted(users) if hierarchy.direct_reports(org, m)}
+                if team_summaries:
+                    st.write("Teams against the org")
+                    st.dataframe(tomo_rows(team_summaries, "Manager"))
+
+            # The breakdowns need every assessment loaded, so they are opt-in
+            if total_submissions and st.toggle("Show detailed breakdown", key="stats_breakdown"):
+                import analytics
+                st.subheader("Assessor Breakdown")
+                st.table(analytics.assessor_breakdown(repo))
+                if total_approved:
+                    st.subheader("Average Score per Criterion")
+                    st.bar_chart(analytics.criterion_means(repo).rename('Average Score'))
+                    st.subheader("Average Score per Role")
+                    st.dataframe(analytics.role_means(repo))
+                    st.subheader("Score Distribution")
+                    st.dataframe(analytics.score_distribution(repo))
+
+        with tabs[1], diagnostics.span("section:manage_assessments"):
             st.subheader("Manage Assessments")
-            all_assessments = []
-            for uname, uassess in data.items():
-                for idx, assess in enumerate(uassess):
-                    all_assessments.append((uname, idx, assess))
-
-            if all_assessments:
-                for uname, idx, assess in all_assessments:
-                    status = assess.get('status', 'Approved')
-                    masked_origin = "Self" if assess['assessor'] == "Self" else f"{assess['assessor']} ({get_masked_id(assess.get('assessor_name', ''))})"
-                    with st.expander(f"User: {uname} - Assessment {idx+1} ({assess['timestamp']}) - Origin: {masked_origin} - Status: {status}"):
-                        if 'scores' in assess:
-                            avg_score = sum(assess['scores'].values()) / len(assess['scores'])
-                            st.write(f"Average Score: {avg_score:.2f}/5")
-                            for crit, score in assess['scores'].items():
-                                st.write(f"- {crit}: {score}")
-                        if 'tomo' in assess:
-                            st.write(f"ToMo: {assess['tomo']}")
-
-                        col1, col2, col3 = st.columns(3)
-                        if status == "Pending Approval":
-                            if col1.button("Approve", key=f"approve_{uname}_{idx}"):
-                                if assess['assessor'] == "Self":
-                                    data[uname] = [a for a in data[uname] if not (a['assessor'] == "Self" and a.get('status', 'Approved') == 'Approved')]
-                                assess['status'] = "Approved"
-                                data[uname].append(assess) if assess['assessor'] == "Self" else None
-                                save_data(data, DATA_FILE)
-                                st.success("Approved and replaced if applicable!")
-                        if status == "Pending Approval" and col2.button("Reject", key=f"reject_{uname}_{idx}"):
-                            assess['status'] = "Rejected"
-                            save_data(data, DATA_FILE)
-                            st.success("Rejected!")
-                        if col3.button("Delete", key=f"delete_{uname}_{idx}"):
-                            del data[uname][idx]
-                            if not data[uname]:
-                                del data[uname]
-                            save_data(data, DATA_FILE)
-                            st.success("Deleted!")
-
-        with tabs[2]:
+            # Filters are applied by the repository; only the current page is fetched
+            col1, col2, col3, col4 = st.columns(4)
+            status_filter = col1.selectbox("Status", ["All", "Pending Approval", "Approved", "Rejected", "Superseded"], key="queue_status")
+            assessor_filter = col2.selectbox("Assessor", ["All", "Self", "Peer", "Manager"], key="queue_assessor")
+            role_filter = col3.selectbox("Role", ["All"] + ROLES, key="queue_role")
+            user_filter = col4.text_input("User", key="queue_user").strip()
+            col1, col2, col3 = st.columns([2, 1, 1])
+            date_range = col1.date_input("Submitted between", value=(), key="queue_dates")
+            page_size = col2.selectbox("Page size", PAGE_SIZES, index=1, key="queue_page_size")
+
+            filters = {
+                "status": None if status_filter == "All" else status_filter,
+                "assessor": None if assessor_filter == "All" else assessor_filter,
+                "role": None if role_filter == "All" else role_filter,
+                "user": user_filter or None,
+                "start": date_range[0] if len(date_range) > 0 else None,
+                "end": date_range[1] if len(date_range) > 1 else None,
+            }
+            page = st.session_state.get("queue_page", 1)
+            total, rows = repo.query_assessments(**filters, offset=(page - 1) * page_size, limit=page_size)
+            pages = max(1, -(-total // page_size))
+            if page > pages:
+                # Filters narrowed the result set; fall back to its last page
+                page = st.session_state["queue_page"] = pages
+                total, rows = repo.query_assessments(**filters, offset=(page - 1) * page_size, limit=page_size)
+            col3.number_input("Page", min_value=1, max_value=pages, key="queue_page")
+            st.caption(f"{total} assessments - page {page} of {pages}")
+
+            # Older writes could append the same assessment twice. Widget keys carry
+            # the copy number so they stay unique, and only the first copy gets
+            # actions; the others can only be removed.
+            queue_rows, copies = [], {}
+            for uname, assess in rows:
+                aid = assessment_id(assess)
+                copy = copies[(uname, aid)] = copies.get((uname, aid), -1) + 1
+                queue_rows.append((uname, assess, aid, f"{uname}_{aid}" + (f"_{copy}" if copy else ""), copy))
+
+            for uname, assess, aid, row_key, copy in queue_rows:
+                status = assess.get('status', 'Approved')
+                masked_origin = "Self" if assess['assessor'] == "Self" else f"{assess['assessor']} ({get_masked_id(assess.get('assessor_name', ''))})"
+                select_col, row_col = st.columns([1, 20])
+                if copy:
+                    row_col.warning(f"Duplicate copy of {uname}'s assessment {aid} ({assess['timestamp']})")
+                    if row_col.button("Remove Duplicate", key=f"dedupe_{row_key}"):
+                        with diagnostics.span("action:dedupe"):
+                            ok, message = repo.commit([{"op": "dedupe", "user": uname, "id": aid}])[0]
+                        (st.success if ok else st.warning)(message)
+                    continue
+                select_col.checkbox("Select", key=f"select_{row_key}", label_visibility="collapsed")
+                # Row details are only built for rows that are opened
+                if row_col.toggle(f"User: {uname} ({assess['timestamp']}) - Origin: {masked_origin} - Status: {status}", key=f"open_{row_key}"):
+                    if 'scores' in assess:
+                        avg_score = sum(assess['scores'].values()) / len(assess['scores'])
+                        st.write(f"Average Score: {avg_score:.2f}/5")
+                        for crit, score in assess['scores'].items():
+                            st.write(f"- {crit}: {score}")
+                    if 'tomo' in assess:
+                        st.write(f"ToMo: {assess['tomo']}")
+
+                    col1, col2, col3 = st.columns(3)
+                    if status == "Pending Approval":
+                        if col1.button("Approve", key=f"approve_{row_key}"):
+                            with diagnostics.span("action:approve"):
+                                ok, message = repo.approve(uname, aid)
+                            (st.success if ok else st.warning)("Approved and replaced if applicable!" if ok else message)
+                    if status == "Pending Approval" and col2.button("Reject", key=f"reject_{row_key}"):
+                        with diagnostics.span("action:reject"):
+                            ok, message = repo.reject(uname, aid)
+                        (st.success if ok else st.warning)("Rejected!" if ok else message)
+                    if col3.button("Delete", key=f"delete_{row_key}"):
+                        with diagnostics.span("action:delete"):
+                            ok, message = repo.delete(uname, aid)
+                        (st.success if ok else st.warning)("Deleted!" if ok else message)
+
+            # Bulk actions are applied as one batch with a single write
+            st.subheader("Bulk Actions")
+            selected = [(uname, aid) for uname, _, aid, row_key, copy in queue_rows
+                        if not copy and st.session_state.get(f"select_{row_key}")]
+            col1, col2, col3 = st.columns(3)
+            bulk_action = None
+            if col1.button(f"Approve Selected ({len(selected)})", disabled=not selected):
+                bulk_action = "approve"
+            if col2.button(f"Reject Selected ({len(selected)})", disabled=not selected):
+                bulk_action = "reject"
+            if col3.button(f"Delete Selected ({len(selected)})", disabled=not selected):
+                bulk_action = "delete"
+            if bulk_action:
+                with diagnostics.span(f"action:bulk_{bulk_action}"):
+                    results = repo.bulk([(bulk_action, uname, aid) for uname, aid in selected])
+                show_bulk_results(results)
+
+            cutoff = st.date_input("Reject pending assessments submitted before", key="queue_cutoff")
+            if st.button(f"Reject All Pending Before {cutoff}"):
+                _, stale = repo.query_assessments(status="Pending Approval", end=cutoff - timedelta(days=1))
+                with diagnostics.span("action:bulk_reject"):
+                    results = repo.bulk([("reject", uname, assessment_id(assess)) for uname, assess in first_copies(stale)])
+                show_bulk_results(results)
+
+            # Exports stream to a temp file on the server, so memory stays flat
+            # however many assessments there are
+            st.subheader("Export / Import")
+            col1, col2 = st.columns(2)
+            export_format = col1.selectbox("Export format", ["csv", "parquet"], key="export_format")
+            if col2.button("Prepare Export"):
+                import transfer
+                discard_export()
+                clear_stale_exports()
+                os.makedirs(EXPORT_DIR, exist_ok=True)
+                fd, export_path = tempfile.mkstemp(suffix=f".{export_format}", dir=EXPORT_DIR)
+                os.close(fd)
+                try:
+                    exported = transfer.export(repo, export_path, export_format)
+                    st.session_state["export_path"] = export_path
+                    st.success(f"Exported {exported} assessments")
+                except RuntimeError as e:
+                    os.remove(export_path)
+                    st.error(str(e))
+            export_path = st.session_state.get("export_path")
+            if export_path and os.path.exists(export_path):
+                # The button holds its own copy of the bytes, so the file goes
+                # once it's been downloaded
+                with open(export_path, 'rb') as f:
+                    st.download_button("Download Export", f, file_name=f"assessments{os.path.splitext(export_path)[1]}",
+                                       on_click=discard_export)
+
+            upload = st.file_uploader("Import assessments (CSV or Parquet)", type=["csv", "parquet"], key="import_file")
+            if upload is not None and st.button("Import"):
+                import transfer
+                try:
+                    with diagnostics.span("action:import"):
+                        if upload.name.endswith(".parquet"):
+                            summary = transfer.import_rows(repo, transfer.read_parquet_rows(upload))
+                        else:
+                            summary = transfer.import_rows(repo, transfer.read_csv_rows(io.TextIOWrapper(upload, encoding="utf-8", newline="")))
+                    st.success(f"Imported {summary['imported']}, skipped {summary['skipped']} already present")
+                    if summary["errors"]:
+                        st.warning(f"{len(summary['errors'])} row(s) rejected")
+                        st.table([{"Row": n, "Problem": error} for n, error in summary["errors"][:100]])
+                except RuntimeError as e:
+                    st.error(str(e))
+
+        with tabs[2], diagnostics.span("section:people"):
             # People tab for user details and role assignment
             st.subheader("People")
             selected_user = st.selectbox("Select User", [u for u in users if u != 'sadmin'])
             if selected_user:
                 st.write(f"User: {selected_user}")
                 current_title = users[selected_user]["title"]
-                new_title = st.selectbox("Assign Title", ROLES, index=ROLES.index(current_title))
+                new_title = st.selectbox("Assign Title", ROLES, index=ROLE_INDEX[current_title])
                 if new_title != current_title:
                     if st.button("Confirm Title Change"):
-                        users[selected_user]["title"] = new_title
-                        save_data(users, USERS_FILE)
+                        repo.update_user(selected_user, title=new_title)
                         st.success("Title updated!")
 
                 # View states and scores
-                u_assess = data.get(selected_user, [])
+                u_assess = repo.user_assessments(selected_user)
                 if u_assess:
                     st.subheader("Assessment Overview")
-                    approved = len([a for a in u_assess if a.get('status', 'Approved') == 'Approved'])
-                    pending = len([a for a in u_assess if a.get('status') == 'Pending Approval'])
-                    rejected = len([a for a in u_assess if a.get('status') == 'Rejected'])
+                    user_counts = repo.user_status_counts(selected_user)
+                    approved = user_counts.get('Approved', 0)
+                    pending = user_counts.get('Pending Approval', 0)
+                    rejected = user_counts.get('Rejected', 0)
                     st.write(f"Approved: {approved}, Pending: {pending}, Rejected: {rejected}")
 
-                    # Compute scores if approved assessments exist
-                    approved_assess = [a for a in u_assess if a.get('status', 'Approved') == 'Approved']
-                    if approved_assess:
-                        all_scores = {}
-                        for assess in approved_assess:
-                            for crit, score in assess['scores'].items():
-                                if crit not in all_scores:
-                                    all_scores[crit] = []
-                                all_scores[crit].append(score)
-                        averages = {crit: sum(scores)/len(scores) for crit, scores in all_scores.items()}
-                        overall_avg = sum(averages.values()) / len(averages) if averages else 0
+                    # Scores come from the stored aggregate if approved assessments exist
+                    agg = repo.user_aggregate(selected_user)
+                    if agg:
+                        averages = aggregate_averages(agg)
+                        overall_avg = overall_average(agg)
                         st.write(f"Overall Average Score: {overall_avg:.2f}/5")
                         st.table(averages)
+
+                    # Trends are range reads over the monthly/quarterly rollups
+                    st.subheader("Trend")
+                    period = trend_period("people_trend_period")
+                    user_trend = history.overall_trend(repo.history("user", selected_user, period))
+                    if user_trend:
+                        first = min(user_trend)
+                        role_trend = history.overall_trend(repo.history("role", users[selected_user]["title"], period, start=first))
+                        trend_chart({selected_user: user_trend, f"{users[selected_user]['title']} average": role_trend})
                 else:
                     st.write("No assessments yet.")
 
+        with tabs[3], diagnostics.span("section:archive"):
+            # Rejected, superseded and duplicate assessments leave the hot store
+            # for compressed per-quarter segments
+            st.subheader("Archive")
+            segment_paths = [os.path.join(repo.archive_dir, name) for name in retention.segments(repo.archive_dir)]
+            if segment_paths:
+                st.table(diagnostics.file_sizes(segment_paths))
+            else:
+                st.write("Nothing archived yet.")
+            col1, col2 = st.columns([2, 1])
+            min_age = col1.number_input("Archive rejected and superseded assessments older than (days)",
+                                        min_value=0, value=retention.MIN_AGE_DAYS, key="archive_min_age")
+            if col2.button("Run Retention Now"):
+                with diagnostics.span("action:archive"):
+                    summary = retention.archive(repo, int(min_age))
+                st.success(f"Archived {summary['archived']} assessments into {len(summary['segments'])} segment(s)")
+
+            # Archive queries decompress segments, so they only run while searching
+            if segment_paths and st.toggle("Search archive", key="archive_search"):
+                col1, col2, col3 = st.columns(3)
+                archive_user = col1.text_input("User", key="archive_user").strip()
+                archive_reason = col2.selectbox("Reason", ["All", "rejected", "superseded", "duplicate"], key="archive_reason")
+                archive_dates = col3.date_input("Submitted between", value=(), key="archive_dates")
+                archive_filters = {
+                    "user": archive_user or None,
+                    "reason": None if archive_reason == "All" else archive_reason,
+                    "start": archive_dates[0] if len(archive_dates) > 0 else None,
+                    "end": archive_dates[1] if len(archive_dates) > 1 else None,
+                }
+                page = st.session_state.get("archive_page", 1)
+                total, records = retention.query(repo.archive_dir, **archive_filters, offset=(page - 1) * 25, limit=25)
+                pages = max(1, -(-total // 25))
+                if page > pages:
+                    page = st.session_state["archive_page"] = pages
+                    total, records = retention.query(repo.archive_dir, **archive_filters, offset=(page - 1) * 25, limit=25)
+                st.number_input("Page", min_value=1, max_value=pages, key="archive_page")
+                st.caption(f"{total} archived assessments - page {page} of {pages}")
+                st.table([{"User": r["user"], "Assessment": assessment_id(r["assessment"]),
+                           "Assessor": r["assessment"].get("assessor"), "Role": r["assessment"].get("role"),
+                           "Submitted": r["assessment"].get("timestamp"), "Reason": r["reason"],
+                           "Archived": r["archived_at"]} for r in records])
+
+        with tabs[4]:
+            # Timings are process-wide: every session served by this server shows up here
+            st.subheader("Diagnostics")
+            diagnostics.set_enabled(st.toggle("Record timings", value=diagnostics.enabled(), key="diagnostics_enabled"))
+            if not diagnostics.enabled():
+                st.info("Instrumentation is off. Turn it on here or start the app with PEAKDESIGNER_DIAGNOSTICS=1.")
+            st.write("Section and operation timings (ms)")
+            st.table(diagnostics.summary())
+            st.write("Cache hit rates")
+            st.table(diagnostics.cache_hit_rates())
+            st.write("Reruns per session")
+            st.table(diagnostics.reruns())
+            st.write("Data files")
+            st.table(diagnostics.file_sizes(repo.data_files()))
+            col1, col2 = st.columns(2)
+            col1.download_button("Download spans (JSONL)", diagnostics.export_jsonl(), file_name="spans.jsonl")
+            if col2.button("Clear timings"):
+                diagnostics.reset()
+
+            # Checked here rather than from the command line because the JSON
+            # stores keep these views in this server's memory
+            st.write("Derived views")
+            col1, col2, col3 = st.columns([2, 1, 1])
+            view_name = col1.selectbox("View", list(VIEW_MODULES), key="view_name")
+            if col2.button("Verify"):
+                with diagnostics.span("action:verify_view"):
+                    drift = repo.verify(view_name)
+                if drift:
+                    st.warning(f"{len(drift)} {view_name} entries drifted")
+                    st.table([{"Key": str(key), "Stored": str(stored), "Expected": str(expected)}
+                              for key, stored, expected in drift[:100]])
+                else:
+                    st.success(f"No {view_name} drift")
+            if col3.button("Rebuild"):
+                with diagnostics.span("action:rebuild_view"):
+                    repo.rebuild(view_name)
+                st.success(f"{view_name} rebuilt")
+
         # User management
         st.subheader("User Management")
         if st.button("Add Manager"):
@@ -285,9 +528,7 @@ else:
                 team_members = st.multiselect("Assign Team Members", [u for u in users if u != 'sadmin' and u != selected_user], default=users.get(selected_user, {}).get("team", []))
                 if st.button("Confirm Changes"):
                     if st.session_state.get("confirm_changes", False):
-                        users[selected_user]["role"] = "Manager"
-                        users[selected_user]["team"] = team_members
-                        save_data(users, USERS_FILE)
+                        repo.update_user(selected_user, role="Manager", team=team_members)
                         st.success("Manager assigned/updated!")
                         st.session_state["show_assign_form"] = False
                         st.session_state["confirm_changes"] = False
@@ -298,12 +539,15 @@ else:
 
         # List of managers
         st.subheader("List of Managers")
+        org = repo.hierarchy()
         managers = [u for u in users if users[u]["role"] == "Manager"]
         if managers:
             for manager in managers:
-                team_size = len(users[manager].get("team", []))
+                team_size = len(hierarchy.direct_reports(org, manager))
+                org_size = len(hierarchy.subtree(org, manager))
+                above = hierarchy.manager_of(org, manager)
                 col1, col2 = st.columns([4, 1])
-                col1.write(f"{manager} - Team Size: {team_size}")
+                col1.write(f"{manager} - Team Size: {team_size}, Org Size: {org_size}" + (f" (reports to {above})" if above else ""))
                 if col2.button("Edit", key=f"edit_{manager}", on_click=edit_manager, args=(manager,)):
                     pass
         else:
@@ -314,8 +558,7 @@ else:
         st.title("Dashboard")
         st.write(f"Welcome, {username} ({title})")
 
-        data = load_data(DATA_FILE)
-        user_assessments = data.get(username, [])
+        user_assessments = repo.user_assessments(username)
         approved_self = [a for a in user_assessments if a['assessor'] == "Self" and a.get('status', 'Approved') == 'Approved']
         has_self = len(approved_self) > 0
 
@@ -324,7 +567,7 @@ else:
             tabs.append("Team Management")
         tab_objects = st.tabs(tabs)
 
-        with tab_objects[0]:
+        with tab_objects[0], diagnostics.span("section:self_assessment"):
             if has_self:
                 if st.button("Submit Assessment"):
                     st.session_state["show_survey"] = True
@@ -333,7 +576,6 @@ else:
 
             if st.session_state.get("show_survey", False) or not has_self:
                 st.subheader("Self Assessment")
-                criteria_list = CRITERIA[title]
 
                 pending = has_self  # If has approved, new is pending
 
@@ -341,49 +583,44 @@ else:
                     st.warning("This submission will require manager approval to replace the existing one.")
 
                 self_scores = {}
-                for crit, desc in criteria_list:
-                    self_scores[crit] = st.slider(f"{crit}: {desc}", 1, 5, 3, key=f"self_{crit.replace(' ', '_')}")
+                for crit, label, key in SELF_SLIDERS[title]:
+                    self_scores[crit] = st.slider(label, 1, 5, 3, key=key)
 
                 st.subheader("Total Motivation (ToMo) Survey")
                 tomo_scores = {}
-                for question, key in SELF_TOMO_QUESTIONS:
-                    tomo_scores[key] = st.slider(question, 1, 7, 4, key=f"tomo_{key}")
-                tomo = (tomo_scores["play"] + tomo_scores["purpose"] + tomo_scores["potential"]) - \
-                       (tomo_scores["emotional"] + tomo_scores["economic"] + tomo_scores["inertia"])
+                for question, component, key in SELF_TOMO_SLIDERS:
+                    tomo_scores[component] = st.slider(question, 1, 7, 4, key=key)
+                tomo_score = tomo_total(tomo_scores)
 
                 if st.button("Submit Self Assessment"):
                     timestamp = datetime.now().isoformat()
                     assessment = {
+                        "id": new_assessment_id(),
                         "assessor": "Self",
                         "role": title,
                         "scores": self_scores,
-                        "tomo": tomo,
+                        "tomo": tomo_score,
                         "tomo_scores": tomo_scores,
                         "timestamp": timestamp,
                         "status": "Pending Approval" if pending else "Approved"
                     }
-                    if username not in data:
-                        data[username] = []
-                    data[username].append(assessment)
-                    save_data(data, DATA_FILE)
-                    st.success("Self Assessment submitted!" + (" (Pending Approval)" if pending else ""))
-                    st.session_state["show_survey"] = False
+                    with diagnostics.span("action:submit"):
+                        ok, message = repo.submit(username, assessment)
+                    if ok:
+                        st.success("Self Assessment submitted!" + (" (Pending Approval)" if pending else ""))
+                        st.session_state["show_survey"] = False
+                    else:
+                        st.warning(message)
 
             if has_self:
                 # Display averages and bar chart
-                assessments = [a for a in user_assessments if a.get('status', 'Approved') == 'Approved']
-                all_scores = {}
-                for assess in assessments:
-                    for crit, score in assess['scores'].items():
-                        if crit not in all_scores:
-                            all_scores[crit] = []
-                        all_scores[crit].append(score)
-                averages = {crit: sum(scores)/len(scores) for crit, scores in all_scores.items()}
-                overall_avg = sum(averages.values()) / len(averages)
-
-                self_count = len([a for a in assessments if a['assessor'] == "Self"])
-                peer_count = len([a for a in assessments if a['assessor'] == "Peer"])
-                manager_count = len([a for a in assessments if a['assessor'] == "Manager"])
+                agg = repo.user_aggregate(username)
+                averages = aggregate_averages(agg)
+                overall_avg = overall_average(agg)
+
+                self_count = agg["assessors"].get("Self", 0)
+                peer_count = agg["assessors"].get("Peer", 0)
+                manager_count = agg["assessors"].get("Manager", 0)
 
                 st.subheader("Overall Average Score")
                 st.write(f"{overall_avg:.2f}/5")
@@ -394,45 +631,83 @@ else:
 
                 # Bar chart visualization
                 st.subheader("Score Diagram")
-                df = pd.DataFrame.from_dict(averages, orient='index', columns=['Average Score'])
-                st.bar_chart(df)
+                score_chart(averages)
+
+                st.subheader("Trend")
+                period = trend_period("self_trend_period")
+                own_history = repo.history("user", username, period)
+                trend_chart({"Overall": history.overall_trend(own_history)})
+                tomo_trend = history.tomo_trend(own_history)
+                if tomo_trend:
+                    st.write("ToMo components")
+                    trend_chart({comp: {b: avgs[comp] for b, avgs in tomo_trend.items() if comp in avgs}
+                                 for comp in TOMO_COMPONENTS})
 
         if role == "Manager":
-            with tab_objects[1]:
+            with tab_objects[1], diagnostics.span("section:team_management"):
                 st.subheader("Team Management")
+                org = repo.hierarchy()
+                if len(hierarchy.subtree(org, username)) > len(hierarchy.direct_reports(org, username)):
+                    # Senior managers see their whole org rolled up per direct report
+                    st.subheader("Org Overview")
+                    org_total = hierarchy.org_rollup(repo, username)
+                    st.write(f"{org_total['members']} people, {org_total['pending']} pending, "
+                             f"overall average {overall_average(org_total):.2f}/5")
+                    st.table(rollup_rows(hierarchy.sub_team_rollups(repo, username)))
+                    if org_total["approved"]:
+                        st.write("Org average per criterion")
+                        score_chart(aggregate_averages(org_total))
+
+                team_pending = first_copies(repo.pending_assessments(team))
+                if team_pending and st.button(f"Approve All Pending for My Team ({len(team_pending)})"):
+                    with diagnostics.span("action:bulk_approve"):
+                        results = repo.bulk([("approve", member, assessment_id(assess)) for member, assess in team_pending])
+                    show_bulk_results(results)
+
+                if team:
+                    st.subheader("Team Trend")
+                    period = trend_period("team_trend_period")
+                    member_histories = {member: repo.history("user", member, period) for member in team}
+                    series = {member: history.overall_trend(h) for member, h in member_histories.items()}
+                    series["Team"] = history.overall_trend(history.merge(member_histories.values()))
+                    trend_chart(series)
+
+                    team_tomo = tomo.team_summary(repo, team)
+                    if team_tomo["count"]:
+                        st.subheader("Team Motivation")
+                        st.write(tomo_line(team_tomo))
+                        st.write(f"Against every approved survey in the org, the team's mean ToMo is at percentile {team_tomo['org_percentile']:.0f}")
+                        st.table(tomo_rows({"Team": team_tomo, "Org": tomo.summary(repo.tomo_histograms("org"))}, "Group"))
+
                 for team_member in team:
                     st.write(f"**{team_member}**")
-                    member_assess = data.get(team_member, [])
+                    member_assess = repo.user_assessments(team_member)
                     # Similar to user view, show averages, bar chart if approved
-                    approved_assess = [a for a in member_assess if a.get('status', 'Approved') == 'Approved']
-                    if approved_assess:
-                        all_scores = {}
-                        for assess in approved_assess:
-                            for crit, score in assess['scores'].items():
-                                if crit not in all_scores:
-                                    all_scores[crit] = []
-                                all_scores[crit].append(score)
-                        averages = {crit: sum(scores)/len(scores) for crit, scores in all_scores.items()}
-                        overall_avg = sum(averages.values()) / len(averages)
-
-                        self_count = len([a for a in approved_assess if a['assessor'] == "Self"])
-                        peer_count = len([a for a in approved_assess if a['assessor'] == "Peer"])
-                        manager_count = len([a for a in approved_assess if a['assessor'] == "Manager"])
+                    agg = repo.user_aggregate(team_member)
+                    if agg:
+                        averages = aggregate_averages(agg)
+                        overall_avg = overall_average(agg)
+
+                        self_count = agg["assessors"].get("Self", 0)
+                        peer_count = agg["assessors"].get("Peer", 0)
+                        manager_count = agg["assessors"].get("Manager", 0)
 
                         st.write(f"Overall Average: {overall_avg:.2f}/5")
                         st.write(f"Assessors: Self = {self_count}, Peer = {peer_count}, Manager = {manager_count}")
                         st.table(averages)
 
                         # Bar chart
-                        df = pd.DataFrame.from_dict(averages, orient='index', columns=['Average Score'])
-                        st.bar_chart(df)
+                        score_chart(averages)
 
                     # Pending approvals
-                    pending_assess = [ (idx, a) for idx, a in enumerate(member_assess) if a.get('status') == 'Pending Approval' ]
+                    first = {id(a) for _, a in first_copies((team_member, a) for a in member_assess)}
+                    pending_assess = [ (idx, a) for idx, a in enumerate(member_assess) if a.get('status') == 'Pending Approval' and id(a) in first ]
                     if pending_assess:
                         st.write("Pending Assessments")
                         for idx, assess in pending_assess:
+                            aid = assessment_id(assess)
                             with st.expander(f"Assessment {idx+1} ({assess['timestamp']}) - {assess['assessor']}"):
+                                st.checkbox("Select for bulk action", key=f"team_select_{team_member}_{aid}")
                                 avg_score = sum(assess['scores'].values()) / len(assess['scores'])
                                 st.write(f"Average Score: {avg_score:.2f}/5")
                                 for crit, score in assess['scores'].items():
@@ -441,14 +716,27 @@ else:
                                     st.write(f"ToMo: {assess['tomo']}")
 
                                 col1, col2 = st.columns(2)
-                                if col1.button("Approve", key=f"team_approve_{team_member}_{idx}"):
-                                    if assess['assessor'] == "Self":
-                                        data[team_member] = [a for a in data[team_member] if not (a['assessor'] == "Self" and a.get('status', 'Approved') == 'Approved')]
-                                    assess['status'] = "Approved"
-                                    data[team_member].append(assess)
-                                    save_data(data, DATA_FILE)
-                                    st.success("Approved!")
-                                if col2.button("Reject", key=f"team_reject_{team_member}_{idx}"):
-                                    assess['status'] = "Rejected"
-                                    save_data(data, DATA_FILE)
-                                    st.success("Rejected!")
\ No newline at end of file
+                                if col1.button("Approve", key=f"team_approve_{team_member}_{aid}"):
+                                    with diagnostics.span("action:approve"):
+                                        ok, message = repo.approve(team_member, aid)
+                                    (st.success if ok else st.warning)("Approved!" if ok else message)
+                                if col2.button("Reject", key=f"team_reject_{team_member}_{aid}"):
+                                    with diagnostics.span("action:reject"):
+                                        ok, message = repo.reject(team_member, aid)
+                                    (st.success if ok else st.warning)("Rejected!" if ok else message)
+
+                selected = [(member, assessment_id(assess)) for member, assess in team_pending
+                            if st.session_state.get(f"team_select_{member}_{assessment_id(assess)}")]
+                if selected:
+                    col1, col2 = st.columns(2)
+                    team_action = None
+                    if col1.button(f"Approve Selected ({len(selected)})", key="team_bulk_approve"):
+                        team_action = "approve"
+                    if col2.button(f"Reject Selected ({len(selected)})", key="team_bulk_reject"):
+                        team_action = "reject"
+                    if team_action:
+                        with diagnostics.span(f"action:bulk_{team_action}"):
+                            results = repo.bulk([(team_action, member, aid) for member, aid in selected])
+                        show_bulk_results(results)
+
+diagnostics.finish("rerun", rerun_started, user=st.session_state.get("username"))
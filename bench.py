@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from constants import ROLES, CRITERIA_NAMES, TOMO_COMPONENTS, tomo_total
+from storage import assessment_id
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+IC_TITLES = ROLES[:4]
+# Management levels from the bottom up; each manages a team of the level below
+MANAGER_TITLES = ["Design Manager", "Senior Design Manager", "Head of Design"]
+ASSESSOR_WEIGHTS = {"Self": 3, "Peer": 4, "Manager": 3}
+STATUS_WEIGHTS = {"Approved": 6, "Pending Approval": 3, "Rejected": 1}
+
+def build_org(rng, n_users, team_size):
+    users = {"sadmin": {"password": "admin", "role": "Superadmin"}}
+    managers = {}
+    # ICs make up roughly (team_size - 1) / team_size of a geometric hierarchy
+    n_ic = max(1, n_users - n_users // team_size)
+    level = [f"designer-{i:06d}" for i in range(n_ic)]
+    for name in level:
+        users[name] = {"password": name, "role": "User", "title": rng.choice(IC_TITLES), "team": None}
+    count = n_ic
+    for manager_title in MANAGER_TITLES:
+        next_level = []
+        for team in (level[i:i + team_size] for i in range(0, len(level), team_size)):
+            name = f"manager-{count:06d}"
+            count += 1
+            users[name] = {"password": name, "role": "Manager", "title": manager_title, "team": team}
+            for member in team:
+                managers[member] = name
+            next_level.append(name)
+        level = next_level
+        if len(level) == 1:
+            break
+    return users, managers
+
+def random_assessment(rng, user, title, assessor, status, timestamp, users_list, managers):
+    assess = {"id": f"{rng.getrandbits(64):016x}", "assessor": assessor}
+    if assessor == "Peer":
+        assess["assessor_name"] = rng.choice(users_list)
+    elif assessor == "Manager":
+        assess["assessor_name"] = managers.get(user, rng.choice(users_list))
+    tomo_scores = {comp: rng.randint(1, 7) for comp in TOMO_COMPONENTS}
+    assess.update({
+        "role": title,
+        "scores": {crit: rng.randint(1, 5) for crit in CRITERIA_NAMES[title]},
+        "tomo": tomo_total(tomo_scores),
+        "tomo_scores": tomo_scores,
+        "timestamp": timestamp.isoformat(),
+        "status": status,
+    })
+    return assess
+
+def generate(out_dir, n_users=10000, n_assessments=1000000, seed=1, team_size=8, days=730):
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    users, managers = build_org(rng, n_users, team_size)
+    with open(os.path.join(out_dir, "users.json"), 'w') as f:
+        json.dump(users, f, indent=4)
+
+    people = [u for u in users if u != 'sadmin']
+    per_user = [0] * len(people)
+    for _ in range(n_assessments):
+        per_user[rng.randrange(len(people))] += 1
+    assessors, assessor_weights = list(ASSESSOR_WEIGHTS), list(ASSESSOR_WEIGHTS.values())
+    statuses, status_weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+    start = datetime(2024, 1, 1)
+
+    # Streamed one user at a time so a million assessments never sit in memory
+    with open(os.path.join(out_dir, "assessments.json"), 'w') as f:
+        f.write("{")
+        written = 0
+        for user, n in zip(people, per_user):
+            if not n:
+                continue
+            title = users[user]["title"]
+            stamps = sorted(start + timedelta(seconds=rng.randrange(days * 86400)) for _ in range(n))
+            assessments = []
+            for i, stamp in enumerate(stamps):
+                if i == 0:
+                    assessor, status = "Self", "Approved"
+                else:
+                    assessor = rng.choices(assessors, assessor_weights)[0]
+                    status = rng.choices(statuses, status_weights)[0]
+                    # The app keeps at most one approved self assessment per user
+                    if assessor == "Self" and status == "Approved":
+                        status = "Pending Approval"
+                assessments.append(random_assessment(rng, user, title, assessor, status, stamp, people, managers))
+            f.write(("," if written else "") + json.dumps(user) + ":" + json.dumps(assessments))
+            written += 1
+        f.write("}")
+    return len(users), n_assessments
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def measure(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg) if setup else fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    # One extra traced run for peak memory, kept out of the timings
+    arg = setup() if setup else None
+    tracemalloc.start()
+    fn(arg) if setup else fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "n": repeat,
+        "p50_ms": round(percentile(samples, 0.50), 3),
+        "p95_ms": round(percentile(samples, 0.95), 3),
+        "mean_ms": round(sum(samples) / len(samples), 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+def data_layer_cases(repo):
+    import storage
+    from storage import assessment_id, thaw
+
+    users = repo.load_users()
+    people = [u for u in users if u != 'sadmin']
+    managers = [u for u in users if users[u].get("team")]
+    pending = iter(repo.pending_assessments())
+
+    def cold_load():
+        if getattr(repo, "data_file", None):
+            storage.invalidate(repo.data_file)
+        repo.load_assessments()
+
+    def next_pending(_=None):
+        user, assess = next(pending)
+        return user, assessment_id(assess)
+
+    cases = {
+        "load_data:cold": (cold_load, None),
+        "load_data:warm": (repo.load_assessments, None),
+        "save_data:users": (lambda: repo.save_users(thaw(repo.load_users())), None),
+        "stats:status_counts": (repo.status_counts, None),
+        "manage:first_page": (lambda: repo.query_assessments(limit=25), None),
+        "manage:pending_page": (lambda: repo.query_assessments(status="Pending Approval", offset=100, limit=25), None),
+        "dashboard:self_aggregate": (lambda u: repo.user_aggregate(u), lambda: random.choice(people)),
+        "team:pending_queue": (lambda m: repo.pending_assessments(users[m]["team"]), lambda: random.choice(managers)),
+        "approve:single": (lambda target: repo.approve(*target), next_pending),
+        "approve:bulk_25": (lambda targets: repo.bulk([("approve", u, aid) for u, aid in targets]),
+                            lambda: [next_pending() for _ in range(25)]),
+    }
+    return cases
+
+def page_cases(repo):
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return {}
+
+    users = repo.load_users()
+    managers = [u for u in users if users[u].get("team")]
+    people = [u for u in users if u != 'sadmin' and not users[u].get("team")]
+    with_self = next(u for u in people if repo.user_aggregate(u))
+
+    def session_for(username):
+        user = users[username]
+        return {"logged_in": True, "username": username, "role": user.get("role", "User"),
+                "title": user.get("title", ""), "team": user.get("team") or []}
+
+    def run_page(session):
+        at = AppTest.from_file(APP, default_timeout=600)
+        for key, value in (session or {}).items():
+            at.session_state[key] = value
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        return at
+
+    def approval_target():
+        # Render a manager's team page with a pending item, ready to click Approve
+        for manager in managers:
+            for member in users[manager]["team"]:
+                for assess in repo.user_assessments(member):
+                    if assess.get("status") == "Pending Approval":
+                        return run_page(session_for(manager)), f"team_approve_{member}_{assessment_id(assess)}"
+        raise RuntimeError("no pending assessments left to approve")
+
+    return {
+        "page:login": (lambda: run_page(None), None),
+        "page:superadmin": (lambda: run_page(session_for("sadmin")), None),
+        "page:self_dashboard": (lambda: run_page(session_for(with_self)), None),
+        "page:manager_team": (lambda: run_page(session_for(managers[0])), None),
+        "page:manager_approve": (lambda target: target[0].button(key=target[1]).click().run(), approval_target),
+    }
+
+def run(data_dir, backend="json", repeat=20, page_repeat=5, out=None, compare=None, only=None):
+    out = os.path.abspath(out) if out else None
+    compare = os.path.abspath(compare) if compare else None
+    os.environ["PEAKDESIGNER_BACKEND"] = backend
+    os.chdir(data_dir)
+    from repository import get_repository
+    repo = get_repository()
+    random.seed(0)
+
+    results = {}
+    for group, cases, n in (("data", data_layer_cases(repo), repeat), ("pages", page_cases(repo), page_repeat)):
+        for name, (fn, setup) in cases.items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            try:
+                results[name] = measure(fn, n, setup)
+            except StopIteration:
+                results[name] = {"skipped": "not enough pending assessments"}
+            print(f"{name:28} {results[name]}")
+        if group == "pages" and not cases:
+            print("page cases skipped: streamlit is not installed")
+
+    report = {
+        "meta": {
+            "backend": backend,
+            "data_dir": os.path.abspath(data_dir),
+            "users": len(repo.load_users()),
+            "python": platform.python_version(),
+            "timestamp": datetime.now().isoformat(),
+        },
+        "results": results,
+    }
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=4)
+    if compare:
+        with open(compare) as f:
+            previous = json.load(f)["results"]
+        print("\ncase                         p50 before -> after")
+        for name, result in results.items():
+            if name in previous and "p50_ms" in result and "p50_ms" in previous[name]:
+                before, after = previous[name]["p50_ms"], result["p50_ms"]
+                change = (after - before) / before * 100 if before else 0
+                print(f"{name:28} {before:10.3f} -> {after:10.3f} ms ({change:+.1f}%)")
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic data generator and benchmarks for peakdesigner")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="write a synthetic users.json/assessments.json")
+    gen.add_argument("out_dir")
+    gen.add_argument("--users", type=int, default=10000)
+    gen.add_argument("--assessments", type=int, default=1000000)
+    gen.add_argument("--seed", type=int, default=1)
+    gen.add_argument("--team-size", type=int, default=8)
+
+    bench = sub.add_parser("run", help="time the data layer and pages against a data directory")
+    bench.add_argument("data_dir")
+    bench.add_argument("--backend", choices=["json", "sqlite", "sharded"], default="json")
+    bench.add_argument("--repeat", type=int, default=20)
+    bench.add_argument("--page-repeat", type=int, default=5)
+    bench.add_argument("--out", help="write results as JSON")
+    bench.add_argument("--compare", help="previous results JSON to compare against")
+    bench.add_argument("--only", nargs="*", help="run only cases starting with these prefixes")
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        n_users, n_assessments = generate(args.out_dir, args.users, args.assessments, args.seed, args.team_size)
+        print(f"Generated {n_users} users and {n_assessments} assessments in {args.out_dir}")
+        print("For other backends: python repository.py migrate|shard, run from that directory")
+    else:
+        run(args.data_dir, args.backend, args.repeat, args.page_repeat, args.out, args.compare, args.only)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Define roles, criteria, and ToMo questions (same as before)
+ROLES = [
+    "Associate Product Designer",
+    "Product Designer",
+    "Lead Product Designer",
+    "Principal Product Designer",
+    "Design Manager",
+    "Senior Design Manager",
+    "Head of Design"
+]
+
+CRITERIA = {
+    "Associate Product Designer": [
+        ("Design Craft", "Basic skills in wireframing, mockups, and UI tools."),
+        ("Research and User Understanding", "Assisting in user needs analysis and simple user journeys."),
+        ("Collaboration and Communication", "Working effectively in teams and communicating ideas clearly."),
+        ("Leadership and Mentoring", "Seeking feedback and learning from others."),
+        ("Strategic Thinking and Impact", "Contributing to meeting business goals at a basic level.")
+    ],
+    "Product Designer": [
+        ("Design Craft", "Proficient in prototyping, visual design, and design systems."),
+        ("Research and User Understanding", "Conducting user tests and gathering feedback independently."),
+        ("Collaboration and Communication", "Collaborating across teams on specs and features."),
+        ("Leadership and Mentoring", "Driving consistency in processes."),
+        ("Strategic Thinking and Impact", "Using data to shape work and evolve products based on feedback.")
+    ],
+    "Lead Product Designer": [
+        ("Design Craft", "Advanced prototyping and guiding aesthetic direction."),
+        ("Research and User Understanding", "Evaluating trends and complex UX patterns."),
+        ("Collaboration and Communication", "Reviewing goals with PMs and providing accurate timelines."),
+        ("Leadership and Mentoring", "Mentoring juniors and initiating product ideas."),
+        ("Strategic Thinking and Impact", "Prioritizing work for efficiency and business impact.")
+    ],
+    "Principal Product Designer": [
+        ("Design Craft", "Expert in complex components and user journeys."),
+        ("Research and User Understanding", "Leading strategic user research and roadmap creation."),
+        ("Collaboration and Communication", "Managing stakeholder expectations across projects."),
+        ("Leadership and Mentoring", "Improving team work through critique and leading by example."),
+        ("Strategic Thinking and Impact", "Demonstrating business thinking and high-impact delivery.")
+    ],
+    "Design Manager": [
+        ("Design Craft", "Overseeing design quality and systems across teams."),
+        ("Research and User Understanding", "Aligning research with product vision."),
+        ("Collaboration and Communication", "Facilitating cross-functional collaboration."),
+        ("Leadership and Mentoring", "Managing team development and career growth."),
+        ("Strategic Thinking and Impact", "Budget management and ensuring project success.")
+    ],
+    "Senior Design Manager": [
+        ("Design Craft", "Setting organization-wide design standards."),
+        ("Research and User Understanding", "Integrating insights into long-term strategies."),
+        ("Collaboration and Communication", "Building partnerships at senior levels."),
+        ("Leadership and Mentoring", "Coaching managers and scaling teams."),
+        ("Strategic Thinking and Impact", "Driving revenue-generating initiatives.")
+    ],
+    "Head of Design": [
+        ("Design Craft", "Defining the overall design philosophy."),
+        ("Research and User Understanding", "Championing user-centric culture."),
+        ("Collaboration and Communication", "Influencing executive decisions."),
+        ("Leadership and Mentoring", "Building and leading high-performing design org."),
+        ("Strategic Thinking and Impact", "Aligning design with company vision and growth.")
+    ]
+}
+
+SELF_TOMO_QUESTIONS = [
+    ("I continue to work in my role because the work itself is enjoyable, interesting, and stimulating. (Play)", "play"),
+    ("I continue to work in my role because I value the impact and outcomes of my work. (Purpose)", "purpose"),
+    ("I continue to work in my role because it connects to my personal growth and future goals. (Potential)", "potential"),
+    ("I continue to work in my role because I feel guilty, anxious, or ashamed if I don't. (Emotional Pressure)", "emotional"),
+    ("I continue to work in my role to gain rewards or avoid financial punishment. (Economic Pressure)", "economic"),
+    ("I continue to work in my role simply because it's routine and I don't think about why. (Inertia)", "inertia")
+]
+
+OTHER_TOMO_QUESTIONS = [
+    ("The person continues to work in their role because the work itself is enjoyable, interesting, and stimulating to them. (Play)", "play"),
+    ("The person continues to work in their role because they value the impact and outcomes of their work. (Purpose)", "purpose"),
+    ("The person continues to work in their role because it connects to their personal growth and future goals. (Potential)", "potential"),
+    ("The person continues to work in their role because they feel guilty, anxious, or ashamed if they don't. (Emotional Pressure)", "emotional"),
+    ("The person continues to work in their role to gain rewards or avoid financial punishment. (Economic Pressure)", "economic"),
+    ("The person continues to work in their role simply because it's routine and they don't think about why. (Inertia)", "inertia")
+]
+
+# Lookup tables derived from the definitions above. This module is imported
+# once per process, unlike app.py which Streamlit re-executes on every rerun.
+ROLE_INDEX = {role: i for i, role in enumerate(ROLES)}
+CRITERIA_NAMES = {role: tuple(crit for crit, _ in criteria) for role, criteria in CRITERIA.items()}
+ALL_CRITERIA = tuple(dict.fromkeys(crit for names in CRITERIA_NAMES.values() for crit in names))
+
+# (criterion, slider label, widget key) per role for the self assessment form
+SELF_SLIDERS = {
+    role: tuple((crit, f"{crit}: {desc}", f"self_{crit.replace(' ', '_')}") for crit, desc in criteria)
+    for role, criteria in CRITERIA.items()
+}
+
+TOMO_COMPONENTS = tuple(key for _, key in SELF_TOMO_QUESTIONS)
+TOMO_POSITIVE = ("play", "purpose", "potential")
+TOMO_NEGATIVE = ("emotional", "economic", "inertia")
+# (question, component, widget key) for the self ToMo survey
+SELF_TOMO_SLIDERS = tuple((question, key, f"tomo_{key}") for question, key in SELF_TOMO_QUESTIONS)
+
+def tomo_total(tomo_scores):
+    return sum(tomo_scores[k] for k in TOMO_POSITIVE) - sum(tomo_scores[k] for k in TOMO_NEGATIVE)
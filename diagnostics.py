@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+
+# Off unless PEAKDESIGNER_DIAGNOSTICS=1 (or switched on from the Diagnostics
+# tab); when off every hook returns after a single flag check
+BUFFER_SIZE = int(os.environ.get("PEAKDESIGNER_TRACE_BUFFER", 10000))
+EXPORT_FILE = os.environ.get("PEAKDESIGNER_TRACE_FILE")
+
+_state = {"enabled": os.environ.get("PEAKDESIGNER_DIAGNOSTICS", "0") == "1"}
+_spans = deque(maxlen=BUFFER_SIZE)
+_counters = Counter()
+_reruns = {}
+_export_lock = threading.Lock()
+
+def enabled():
+    return _state["enabled"]
+
+def set_enabled(flag):
+    _state["enabled"] = bool(flag)
+
+def _record(name, started, duration, fields):
+    span = {"name": name, "start": started, "ms": round(duration * 1000, 3), **fields}
+    _spans.append(span)
+    if EXPORT_FILE:
+        with _export_lock:
+            with open(EXPORT_FILE, 'a') as f:
+                f.write(json.dumps(span) + "\n")
+
+@contextmanager
+def span(name, **fields):
+    if not _state["enabled"]:
+        yield
+        return
+    started = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, started, time.perf_counter() - t0, fields)
+
+# For spans that can't be a with block, such as a whole script rerun
+def start():
+    return time.perf_counter() if _state["enabled"] else None
+
+def finish(name, t0, **fields):
+    if t0 is not None:
+        duration = time.perf_counter() - t0
+        _record(name, time.time() - duration, duration, fields)
+
+def traced(name):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state["enabled"]:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    if _state["enabled"]:
+        _counters[name] += n
+
+def note_rerun(session, user=None):
+    if _state["enabled"]:
+        entry = _reruns.setdefault(session, {"session": session, "user": None, "reruns": 0})
+        entry["reruns"] += 1
+        entry["user"] = user or entry["user"]
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def summary():
+    durations = {}
+    for s in list(_spans):
+        durations.setdefault(s["name"], []).append(s["ms"])
+    rows = []
+    for name, values in sorted(durations.items()):
+        values.sort()
+        rows.append({"span": name, "count": len(values), "p50_ms": _percentile(values, 0.5),
+                     "p95_ms": _percentile(values, 0.95), "max_ms": values[-1]})
+    return rows
+
+def cache_hit_rates():
+    rows = []
+    for name in sorted({key.rsplit(":", 1)[0] for key in _counters if key.endswith((":hit", ":miss"))}):
+        hits, misses = _counters[f"{name}:hit"], _counters[f"{name}:miss"]
+        rows.append({"cache": name, "hits": hits, "misses": misses,
+                     "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0})
+    return rows
+
+def reruns():
+    return sorted(_reruns.values(), key=lambda r: -r["reruns"])
+
+def export_jsonl():
+    return "".join(json.dumps(s) + "\n" for s in list(_spans))
+
+def reset():
+    _spans.clear()
+    _counters.clear()
+    _reruns.clear()
+
+def _size(path):
+    if os.path.isdir(path):
+        total = files = 0
+        for entry in os.scandir(path):
+            if entry.is_file():
+                total += entry.stat().st_size
+                files += 1
+        return total, files
+    return os.path.getsize(path), 1
+
+def file_sizes(paths):
+    rows = []
+    for path in paths:
+        if os.path.exists(path):
+            size, files = _size(path)
+            rows.append({"path": path, "files": files, "kb": round(size / 1024, 1)})
+    return rows
@@ -0,0 +1,136 @@
+import threading
+import storage
+import aggregates
+
+# Org index over users.json team lists:
+# {"reports": {manager: (member, ...)}, "manager_of": {member: manager},
+#  "subtrees": {manager: frozenset(everyone below)}}
+# Subtrees are filled in on first use and all dropped when any team changes:
+# a user can sit on several teams, so a change reaches managers that the
+# manager_of chain doesn't lead to.
+def build(users):
+    index = {"reports": {}, "manager_of": {}, "subtrees": {}}
+    for user, record in users.items():
+        _set_team(index, user, record.get("team") or ())
+    return index
+
+def _set_team(index, manager, team):
+    team = tuple(dict.fromkeys(team))
+    if team:
+        index["reports"][manager] = team
+    else:
+        index["reports"].pop(manager, None)
+    for member in team:
+        # A user listed on two teams reports to the alphabetically first manager,
+        # so patched and rebuilt indexes agree
+        current = index["manager_of"].get(member)
+        if current is None or manager < current:
+            index["manager_of"][member] = manager
+
+def update(index, user, before, after):
+    old = tuple((before or {}).get("team") or ())
+    new = tuple((after or {}).get("team") or ())
+    if old == new:
+        return
+    index["subtrees"].clear()
+    _set_team(index, user, new)
+    for member in set(old) - set(new):
+        if index["manager_of"].get(member) == user:
+            del index["manager_of"][member]
+            claims = [manager for manager, team in index["reports"].items() if member in team]
+            if claims:
+                index["manager_of"][member] = min(claims)
+
+storage.register_view("hierarchy", build, update)
+
+def direct_reports(index, manager):
+    return index["reports"].get(manager, ())
+
+def manager_of(index, user):
+    return index["manager_of"].get(user)
+
+def chain(index, user):
+    managers, seen = [], {user}
+    manager = index["manager_of"].get(user)
+    while manager is not None and manager not in seen:
+        managers.append(manager)
+        seen.add(manager)
+        manager = index["manager_of"].get(manager)
+    return managers
+
+def subtree(index, manager):
+    members = index["subtrees"].get(manager)
+    if members is None:
+        found, stack = set(), list(direct_reports(index, manager))
+        while stack:
+            member = stack.pop()
+            if member in found or member == manager:
+                continue
+            found.add(member)
+            stack.extend(direct_reports(index, member))
+        members = index["subtrees"][manager] = frozenset(found)
+    return members
+
+def is_in_subtree(index, manager, user):
+    return user in subtree(index, manager)
+
+# Rolled-up analytics per node, summed from the per-user aggregates and status
+# counts so no assessment list is read. Cached per repository and data version.
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+def empty_rollup():
+    rollup = aggregates.empty_aggregate()
+    rollup.update(members=0, pending=0)
+    return rollup
+
+def _merge(total, part):
+    for sums, counts in (("sums", "counts"), ("tomo_sums", "tomo_counts")):
+        for key, value in part[sums].items():
+            total[sums][key] = total[sums].get(key, 0) + value
+            total[counts][key] = total[counts].get(key, 0) + part[counts][key]
+    for assessor, n in part["assessors"].items():
+        total["assessors"][assessor] = total["assessors"].get(assessor, 0) + n
+    for key in ("approved", "members", "pending"):
+        total[key] += part.get(key, 0)
+
+def _node(repo, user):
+    rollup = empty_rollup()
+    agg = repo.user_aggregate(user)
+    if agg:
+        _merge(rollup, agg)
+    rollup["members"] = 1
+    rollup["pending"] = repo.user_status_counts(user).get("Pending Approval", 0)
+    return rollup
+
+def _nodes(repo):
+    version = repo.data_version()
+    entry = _rollups.get(id(repo))
+    if entry is None or entry["version"] != version:
+        entry = {"version": version, "nodes": {}}
+        with _rollups_lock:
+            _rollups[id(repo)] = entry
+    return entry["nodes"]
+
+# Totals for a user and everyone below them
+def team_rollup(repo, user, index=None, _path=()):
+    index = index or repo.hierarchy()
+    nodes = _nodes(repo)
+    if user not in nodes:
+        rollup = _node(repo, user)
+        for member in direct_reports(index, user):
+            if member not in _path and member != user:
+                _merge(rollup, team_rollup(repo, member, index, (*_path, user)))
+        nodes[user] = rollup
+    return nodes[user]
+
+# One row per direct report, each covering that report's whole sub-team
+def sub_team_rollups(repo, manager):
+    index = repo.hierarchy()
+    return {member: team_rollup(repo, member, index) for member in direct_reports(index, manager)}
+
+def org_rollup(repo, manager):
+    rollup = empty_rollup()
+    for part in sub_team_rollups(repo, manager).values():
+        _merge(rollup, part)
+    return rollup
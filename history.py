@@ -0,0 +1,179 @@
+import sys
+from collections import Counter
+import storage
+import aggregates
+from constants import ALL_CRITERIA, TOMO_COMPONENTS
+from storage import assessment_id
+
+PERIODS = ("month", "quarter")
+# Superseded self assessments stay in the history they were approved into
+COUNTED = ("Approved", "Superseded")
+
+# Time-bucketed rollups over counted assessments, per user and per role (the
+# title recorded on the assessment):
+# {"user": {user: {period: {bucket: aggregate}}}, "role": {role: {...}}}
+# Buckets are "2024-01" for months and "2024-Q1" for quarters, so they sort
+# as strings and a date range is a slice.
+def bucket(timestamp, period):
+    if period == "month":
+        return timestamp[:7]
+    return f"{timestamp[:4]}-Q{(int(timestamp[5:7]) + 2) // 3}"
+
+def is_counted(assess):
+    return assess.get('status', 'Approved') in COUNTED and bool(assess.get('timestamp'))
+
+def _scopes(user, assess):
+    yield "user", user
+    if assess.get('role') is not None:
+        yield "role", assess['role']
+
+def add(state, user, assess, sign=1, shared=True):
+    for scope, key in _scopes(user, assess):
+        periods = state[scope].setdefault(key, {period: {} for period in PERIODS})
+        for period in PERIODS:
+            # Once built, the state is shared with sessions that may be reading
+            # it, so updates copy what they touch instead of patching in place
+            buckets = dict(periods[period]) if shared else periods[period]
+            b = bucket(assess['timestamp'], period)
+            if b not in buckets:
+                agg = aggregates.empty_aggregate()
+            else:
+                agg = aggregates.copy_aggregate(buckets[b]) if shared else buckets[b]
+            aggregates.add_assessment(agg, assess, sign)
+            if agg["approved"]:
+                buckets[b] = agg
+            else:
+                buckets.pop(b, None)
+            periods[period] = buckets
+
+def build(data):
+    state = {"user": {}, "role": {}}
+    for user, assessments in data.items():
+        for assess in assessments:
+            if is_counted(assess):
+                add(state, user, assess, shared=False)
+    return state
+
+def update(state, user, before, after):
+    old = Counter(assessment_id(a) for a in before if is_counted(a))
+    new = Counter(assessment_id(a) for a in after if is_counted(a))
+    if old == new:
+        return
+    by_id = {assessment_id(a): a for a in (*before, *after)}
+    for aid, n in (old - new).items():
+        for _ in range(n):
+            add(state, user, by_id[aid], -1)
+    for aid, n in (new - old).items():
+        for _ in range(n):
+            add(state, user, by_id[aid])
+
+storage.register_view("history", build, update)
+
+# The sharded store keeps each user's role history in their manifest entry,
+# so role history is summed from the manifest without opening a shard. Only
+# months are kept (a quarter is the sum of its months), each packed into one
+# string so the manifest stays small:
+# {role: {month: "approved sum count sum count ..."}} over PACKED_NAMES. A
+# month with scores under any other name is kept whole instead.
+PACKED_NAMES = (("sums", "counts", ALL_CRITERIA), ("tomo_sums", "tomo_counts", TOMO_COMPONENTS))
+
+def pack(agg):
+    if any(set(agg[sums]) - set(names) for sums, _, names in PACKED_NAMES):
+        return {"approved": agg["approved"], **entry(agg)}
+    values = [agg["approved"]]
+    for sums, counts, names in PACKED_NAMES:
+        for name in names:
+            values += [agg[sums].get(name, 0), agg[counts].get(name, 0)]
+    return " ".join(map(str, values))
+
+def unpack(packed):
+    agg = aggregates.empty_aggregate()
+    if not isinstance(packed, str):
+        agg.update({key: dict(packed[key]) for key in ("sums", "counts", "tomo_sums", "tomo_counts")},
+                   approved=packed["approved"])
+        return agg
+    values = iter(map(int, packed.split()))
+    agg["approved"] = next(values)
+    for sums, counts, names in PACKED_NAMES:
+        for name in names:
+            total, n = next(values), next(values)
+            if n:
+                agg[sums][name], agg[counts][name] = total, n
+    return agg
+
+def user_roles(user, assessments):
+    return {role: {month: pack(agg) for month, agg in periods["month"].items()}
+            for role, periods in build({user: assessments})["role"].items()}
+
+def _add_entry(state, entry, sign):
+    for role, months in ((entry or {}).get("history") or {}).items():
+        periods = state["role"].setdefault(role, {period: {} for period in PERIODS})
+        for period in PERIODS:
+            buckets = dict(periods[period])
+            for month, packed in months.items():
+                b = bucket(month, period)
+                agg = aggregates.copy_aggregate(buckets[b]) if b in buckets else aggregates.empty_aggregate()
+                aggregates.add_aggregate(agg, unpack(packed), sign)
+                if agg["approved"]:
+                    buckets[b] = agg
+                else:
+                    buckets.pop(b, None)
+            periods[period] = buckets
+
+def build_manifest(manifest):
+    state = {"user": {}, "role": {}}
+    for entry in manifest.values():
+        _add_entry(state, entry, 1)
+    return state
+
+def update_manifest(state, user, before, after):
+    if (before or {}).get("history") == (after or {}).get("history"):
+        return
+    _add_entry(state, before, -1)
+    _add_entry(state, after, 1)
+
+storage.register_view("manifest_history", build_manifest, update_manifest)
+
+def entry(agg):
+    return {"sums": dict(agg["sums"]), "counts": dict(agg["counts"]),
+            "tomo_sums": dict(agg["tomo_sums"]), "tomo_counts": dict(agg["tomo_counts"])}
+
+def read(state, scope, key, period="month", start=None, end=None):
+    buckets = state.get(scope, {}).get(key, {}).get(period, {})
+    return {b: entry(buckets[b]) for b in sorted(buckets)
+            if (start is None or b >= start) and (end is None or b <= end)}
+
+# Sums several histories bucket by bucket, e.g. a team from its members
+def merge(histories):
+    merged = {}
+    for buckets in histories:
+        for b, part in buckets.items():
+            total = merged.setdefault(b, {"sums": {}, "counts": {}, "tomo_sums": {}, "tomo_counts": {}})
+            for sums, counts in (("sums", "counts"), ("tomo_sums", "tomo_counts")):
+                for name, value in part[sums].items():
+                    total[sums][name] = total[sums].get(name, 0) + value
+                    total[counts][name] = total[counts].get(name, 0) + part[counts][name]
+    return dict(sorted(merged.items()))
+
+def overall_trend(buckets):
+    return {b: aggregates.overall_average(agg) for b, agg in buckets.items() if agg["sums"]}
+
+def criteria_trend(buckets):
+    return {b: aggregates.averages(agg) for b, agg in buckets.items()}
+
+def tomo_trend(buckets):
+    return {b: aggregates.tomo_averages(agg) for b, agg in buckets.items() if agg["tomo_sums"]}
+
+def flatten(state):
+    return {(scope, key, period, b): entry(agg)
+            for scope, keys in state.items() for key, periods in keys.items()
+            for period, buckets in periods.items() for b, agg in buckets.items()}
+
+def diff(stored, expected):
+    return [(key, stored.get(key), expected.get(key)) for key in sorted(set(stored) | set(expected), key=str)
+            if stored.get(key) != expected.get(key)]
+
+if __name__ == "__main__":
+    # python history.py verify|rebuild
+    from repository import view_cli
+    view_cli("history", sys.argv)
@@ -0,0 +1,1040 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import weakref
+from datetime import timedelta
+import storage
+import aggregates
+import diagnostics
+import hierarchy
+import history
+import retention
+import tomo
+from storage import DATA_FILE, USERS_FILE, VersionConflict, load_data, load_versioned, load_view, save_data, assessment_id
+
+DB_FILE = os.environ.get("PEAKDESIGNER_DB", "peakdesigner.db")
+SHARD_DIR = os.environ.get("PEAKDESIGNER_SHARDS", "shards")
+
+# Keys stored in their own columns/tables; anything else rides along in `extra`
+ASSESSMENT_COLUMNS = ("id", "assessor", "assessor_name", "role", "status", "timestamp", "tomo")
+CHILD_KEYS = ("scores", "tomo_scores")
+
+# Date filters are inclusive calendar days; timestamps are ISO strings so the
+# bounds can be compared as text
+def timestamp_bounds(start=None, end=None):
+    return (start.isoformat() if start else None, (end + timedelta(days=1)).isoformat() if end else None)
+
+def matches_filters(assess, status=None, assessor=None, role=None, low=None, high=None):
+    if status is not None and assess.get('status', 'Approved') != status:
+        return False
+    if assessor is not None and assess.get('assessor') != assessor:
+        return False
+    if role is not None and assess.get('role') != role:
+        return False
+    if low is not None and assess.get('timestamp', '') < low:
+        return False
+    if high is not None and assess.get('timestamp', '') >= high:
+        return False
+    return True
+
+def bulk_results(actions, results):
+    return [{"action": action, "user": user, "id": aid, "ok": ok, "result": message}
+            for (action, user, aid), (ok, message) in zip(actions, results)]
+
+# The derived views every backend keeps, by the module that builds them
+VIEW_MODULES = {"aggregates": aggregates, "history": history, "tomo": tomo}
+
+# Aggregates compare per user as built; history and ToMo compare flattened
+# buckets and bins
+def view_drift(name, stored, expected):
+    if name == "aggregates":
+        return aggregates.diff(stored, expected)
+    module = VIEW_MODULES[name]
+    return module.diff(module.flatten(stored), module.flatten(expected))
+
+# python <view>.py verify|rebuild, for any of VIEW_MODULES. Only views a
+# backend keeps on disk can be checked from another process.
+def view_cli(name, argv):
+    if len(argv) != 2 or argv[1] not in ("verify", "rebuild"):
+        print(f"usage: python {name}.py verify|rebuild")
+        sys.exit(1)
+    repo = get_repository()
+    if name not in repo.STORED_VIEWS:
+        print(f"Nothing to {argv[1]}: {type(repo).__name__} keeps {name} in each process's memory, so this process "
+              f"would only compare the data with itself and can't reach the running app's copy. "
+              f"Use Derived views on the app's Diagnostics tab instead.")
+        return
+    drift = repo.verify(name)
+    for key, stored, expected in drift:
+        print(f"{key}: stored={stored} expected={expected}")
+    print(f"{name}: {len(drift)} drifted")
+    if argv[1] == "rebuild":
+        repo.rebuild(name)
+        print(f"{name} rebuilt")
+
+class JsonRepository:
+    # Views built in memory by every process are left out
+    STORED_VIEWS = ()
+
+    def __init__(self, data_file=DATA_FILE, users_file=USERS_FILE, archive_dir=retention.ARCHIVE_DIR):
+        self.data_file = data_file
+        self.users_file = users_file
+        self.archive_dir = archive_dir
+
+    def load_users(self):
+        return load_data(self.users_file)
+
+    def load_users_versioned(self):
+        return load_versioned(self.users_file)
+
+    def save_users(self, users, expected_version=None):
+        save_data(users, self.users_file, expected_version=expected_version)
+
+    def update_user(self, username, **fields):
+        storage.update_user(username, file=self.users_file, **fields)
+
+    def data_version(self):
+        return (storage.data_version(self.data_file), storage.data_version(self.users_file))
+
+    def data_files(self):
+        return [path for file in (self.data_file, self.users_file)
+                for path in (file, storage.compacting_path(file), storage.journal_path(file))] + [self.archive_dir]
+
+    def load_assessments(self):
+        return load_data(self.data_file)
+
+    def user_assessments(self, user):
+        return load_data(self.data_file).get(user, ())
+
+    def iter_assessments(self):
+        for user, assessments in load_data(self.data_file).items():
+            for assess in assessments:
+                yield user, assess
+
+    def pending_assessments(self, users=None):
+        data = load_data(self.data_file)
+        users = data.keys() if users is None else users
+        return [(u, a) for u in users for a in data.get(u, ()) if a.get('status') == 'Pending Approval']
+
+    def query_assessments(self, status=None, user=None, assessor=None, role=None, start=None, end=None, offset=0, limit=None):
+        data = load_data(self.data_file)
+        low, high = timestamp_bounds(start, end)
+        matches = [(u, a) for u in ([user] if user is not None else data) for a in data.get(u, ())
+                   if matches_filters(a, status, assessor, role, low, high)]
+        return len(matches), matches[offset:offset + limit if limit is not None else None]
+
+    def _user_status_counts(self):
+        return load_view(self.data_file, "status_counts")
+
+    def user_status_counts(self, user):
+        return dict(self._user_status_counts().get(user, {}))
+
+    def status_counts(self):
+        per_user = self._user_status_counts()
+        counts = {}
+        for u in self.load_users():
+            if u == 'sadmin':
+                continue
+            for status, n in per_user.get(u, {}).items():
+                counts[status] = counts.get(status, 0) + n
+        return counts
+
+    def user_aggregate(self, user):
+        return load_view(self.data_file, "aggregates").get(user)
+
+    def hierarchy(self):
+        return load_view(self.users_file, "hierarchy")
+
+    # scope is "user" or "role"; start/end are buckets such as "2024-01"
+    def history(self, scope, key, period="month", start=None, end=None):
+        return history.merge([history.read(load_view(self.data_file, "history"), scope, key, period, start, end),
+                              retention.archived_history(scope, key, period, start, end, self.archive_dir)])
+
+    def tomo_histograms(self, scope, keys=None):
+        return tomo.select(load_view(self.data_file, "tomo"), scope, keys)
+
+    # name is one of VIEW_MODULES
+    def verify(self, name):
+        return view_drift(name, load_view(self.data_file, name), VIEW_MODULES[name].build(load_data(self.data_file)))
+
+    def rebuild(self, name):
+        storage.reset_view(self.data_file, name)
+
+    def submit(self, user, assessment):
+        return storage.submit_assessment(user, assessment, file=self.data_file)
+
+    def approve(self, user, aid):
+        return storage.approve_assessment(user, aid, file=self.data_file)
+
+    def reject(self, user, aid):
+        return storage.reject_assessment(user, aid, file=self.data_file)
+
+    def delete(self, user, aid):
+        return storage.delete_assessment(user, aid, file=self.data_file)
+
+    def bulk(self, actions):
+        actions = list(actions)
+        ops = [{"op": action, "user": user, "id": aid} for action, user, aid in actions]
+        return bulk_results(actions, storage.commit(self.data_file, ops))
+
+    # Raw storage ops (add/approve/reject/delete) applied as one batch
+    def commit(self, ops):
+        return storage.commit(self.data_file, list(ops))
+
+    # Folds the journal into the snapshot now, e.g. after an archive run
+    def compact(self):
+        storage.compact(self.data_file)
+
+def shard_name(user):
+    # Readable but filesystem-safe, with a hash so distinct names never collide
+    safe = re.sub(r'[^A-Za-z0-9_-]', '_', user)[:40]
+    return f"{safe}-{hashlib.md5(user.encode('utf-8')).hexdigest()[:8]}.json"
+
+# What the manifest keeps per user: their shard, status counts, ToMo bins and
+# role history buckets
+def manifest_entry(file, user, assessments):
+    return {"file": file, "counts": aggregates.count_statuses(assessments), "tomo": tomo.user_bins(user, assessments),
+            "history": history.user_roles(user, assessments)}
+
+# One journaled JSON file per user plus a manifest mapping each user to their
+# shard and the rollups read across users (see manifest_entry). Users are
+# still kept in users.json.
+class ShardedRepository(JsonRepository):
+    # Role history and ToMo are summed from the manifest; per-user history and
+    # aggregates are built in memory from each shard
+    STORED_VIEWS = ("history", "tomo")
+
+    def __init__(self, shard_dir=SHARD_DIR, users_file=USERS_FILE, archive_dir=retention.ARCHIVE_DIR):
+        super().__init__(data_file=None, users_file=users_file, archive_dir=archive_dir)
+        self.shard_dir = shard_dir
+        self.manifest_file = os.path.join(shard_dir, "manifest.json")
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def shard_file(self, user):
+        entry = load_data(self.manifest_file).get(user)
+        return os.path.join(self.shard_dir, entry['file'] if entry else shard_name(user))
+
+    def manifest(self):
+        return load_data(self.manifest_file)
+
+    def _shard_files(self):
+        return sorted({os.path.join(self.shard_dir, entry['file']) for entry in self.manifest().values()})
+
+    def data_version(self):
+        return (storage.data_version(self.manifest_file), storage.data_version(self.users_file))
+
+    def data_files(self):
+        return [self.shard_dir, self.users_file, storage.journal_path(self.users_file), self.archive_dir]
+
+    def load_assessments(self):
+        return {user: self.user_assessments(user) for user in self.manifest()}
+
+    def user_assessments(self, user):
+        if user not in self.manifest():
+            return ()
+        return load_data(self.shard_file(user)).get(user, ())
+
+    def iter_assessments(self):
+        # Shards are read uncached so a full scan doesn't fill the process cache
+        for user in self.manifest():
+            for assess in storage.read_data(self.shard_file(user)).get(user, ()):
+                yield user, assess
+
+    def pending_assessments(self, users=None):
+        manifest = self.manifest()
+        users = manifest.keys() if users is None else users
+        return [(u, a) for u in users if manifest.get(u, {}).get('counts', {}).get('Pending Approval')
+                for a in self.user_assessments(u) if a.get('status') == 'Pending Approval']
+
+    def query_assessments(self, status=None, user=None, assessor=None, role=None, start=None, end=None, offset=0, limit=None):
+        manifest = self.manifest()
+        users = [user] if user is not None else list(manifest)
+        low, high = timestamp_bounds(start, end)
+        if assessor is None and role is None and low is None and high is None:
+            # The manifest counts give the total, so only shards on the page are read
+            sizes = [(u, sum(manifest[u]['counts'].values()) if status is None else manifest[u]['counts'].get(status, 0))
+                     for u in users if u in manifest]
+            total = sum(n for _, n in sizes)
+            page, skip = [], offset
+            for u, n in sizes:
+                if limit is not None and len(page) >= limit:
+                    break
+                if skip >= n:
+                    skip -= n
+                    continue
+                rows = [(u, a) for a in self.user_assessments(u) if matches_filters(a, status)]
+                page.extend(rows[skip:])
+                skip = 0
+            return total, page[:limit] if limit is not None else page
+        matches = [(u, a) for u in users for a in self.user_assessments(u)
+                   if matches_filters(a, status, assessor, role, low, high)]
+        return len(matches), matches[offset:offset + limit if limit is not None else None]
+
+    def user_status_counts(self, user):
+        return dict(self.manifest().get(user, {}).get('counts', {}))
+
+    def status_counts(self):
+        manifest = self.manifest()
+        counts = {}
+        for u in self.load_users():
+            if u == 'sadmin' or u not in manifest:
+                continue
+            for status, n in manifest[u]['counts'].items():
+                counts[status] = counts.get(status, 0) + n
+        return counts
+
+    def user_aggregate(self, user):
+        if user not in self.manifest():
+            return None
+        return load_view(self.shard_file(user), "aggregates").get(user)
+
+    # Role history spans every shard, so it is read off a view over the
+    # manifest's per-user role buckets rather than from the shards
+    def history(self, scope, key, period="month", start=None, end=None):
+        archived = retention.archived_history(scope, key, period, start, end, self.archive_dir)
+        if scope == "user":
+            if key not in self.manifest():
+                return archived
+            return history.merge([history.read(load_view(self.shard_file(key), "history"), scope, key, period, start, end), archived])
+        return history.merge([history.read(load_view(self.manifest_file, "manifest_history"), scope, key, period, start, end),
+                              archived])
+
+    # Each manifest entry carries its user's ToMo bins, so every scope is read
+    # off a view over the manifest and no shard is opened
+    def tomo_histograms(self, scope, keys=None):
+        return tomo.select(load_view(self.manifest_file, "manifest_tomo"), scope, keys)
+
+    # ToMo lives in the manifest, history in the shards for users and in the
+    # manifest for roles, and aggregates in the shards
+    def verify(self, name):
+        if name == "tomo":
+            return view_drift(name, load_view(self.manifest_file, "manifest_tomo"), tomo.build(self.load_assessments()))
+        drift = []
+        for shard in self._shard_files():
+            stored, expected = load_view(shard, name), VIEW_MODULES[name].build(load_data(shard))
+            if name == "history":
+                stored, expected = {"user": stored["user"]}, {"user": expected["user"]}
+            drift.extend(view_drift(name, stored, expected))
+        if name == "history":
+            drift.extend(view_drift(name, {"role": load_view(self.manifest_file, "manifest_history")["role"]},
+                                    {"role": history.build(self.load_assessments())["role"]}))
+        return drift
+
+    def rebuild(self, name):
+        if name in self.STORED_VIEWS:
+            self.rebuild_manifest()
+        if name != "tomo":
+            for shard in self._shard_files():
+                storage.reset_view(shard, name)
+
+    def rebuild_manifest(self):
+        entries = {}
+        # A shard that has only been appended to so far exists as just its journal
+        names = {name[:-len(".log")] if name.endswith(".json.log") else name for name in os.listdir(self.shard_dir)}
+        for name in sorted(names):
+            path = os.path.join(self.shard_dir, name)
+            if not name.endswith(".json") or path == self.manifest_file:
+                continue
+            for user, assessments in storage.read_data(path).items():
+                entries[user] = manifest_entry(name, user, assessments)
+        save_data(entries, self.manifest_file)
+
+    # Ops are committed per shard, then the touched users' manifest entries go
+    # to the manifest in one append. Both are taken under the shard's lock
+    # and carry the shard's version, so a slower writer's older entry never
+    # replaces a newer one.
+    def _commit(self, ops):
+        by_user = {}
+        for i, op in enumerate(ops):
+            by_user.setdefault(op['user'], []).append(i)
+        results = [None] * len(ops)
+        puts = []
+        for user, indexes in by_user.items():
+            shard = self.shard_file(user)
+            shard_results, changes, version = storage.commit_changes(shard, [ops[i] for i in indexes])
+            for i, result in zip(indexes, shard_results):
+                results[i] = result
+            if user in changes:
+                puts.append({"op": "put", "user": user, "version": version,
+                             "value": {**manifest_entry(os.path.basename(shard), user, changes[user][1]), "version": version}})
+        if puts:
+            storage.commit(self.manifest_file, puts)
+        return results
+
+    def submit(self, user, assessment):
+        return self._commit([{"op": "add", "user": user, "assessment": assessment}])[0]
+
+    def approve(self, user, aid):
+        return self._commit([{"op": "approve", "user": user, "id": aid}])[0]
+
+    def reject(self, user, aid):
+        return self._commit([{"op": "reject", "user": user, "id": aid}])[0]
+
+    def delete(self, user, aid):
+        return self._commit([{"op": "delete", "user": user, "id": aid}])[0]
+
+    def bulk(self, actions):
+        actions = list(actions)
+        ops = [{"op": action, "user": user, "id": aid} for action, user, aid in actions]
+        return bulk_results(actions, self._commit(ops))
+
+    def commit(self, ops):
+        return self._commit(list(ops))
+
+    def compact(self):
+        for user in self.manifest():
+            shard = self.shard_file(user)
+            if os.path.exists(storage.journal_path(shard)):
+                storage.compact(shard)
+        storage.compact(self.manifest_file)
+
+def migrate_shards(shard_dir=SHARD_DIR, data_file=DATA_FILE):
+    repo = ShardedRepository(shard_dir)
+    data = storage.read_data(data_file)
+    manifest = {}
+    for user, assessments in data.items():
+        name = shard_name(user)
+        save_data({user: assessments}, os.path.join(shard_dir, name))
+        manifest[user] = manifest_entry(name, user, assessments)
+    save_data(manifest, repo.manifest_file)
+    return len(manifest), sum(len(a) for a in data.values())
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT,
+    role TEXT,
+    title TEXT,
+    team TEXT
+);
+CREATE TABLE IF NOT EXISTS assessments (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    user TEXT NOT NULL,
+    assessor TEXT,
+    assessor_name TEXT,
+    role TEXT,
+    status TEXT NOT NULL,
+    timestamp TEXT,
+    tomo INTEGER,
+    extra TEXT,
+    UNIQUE (user, id)
+);
+CREATE INDEX IF NOT EXISTS idx_assessments_user ON assessments (user, seq);
+CREATE INDEX IF NOT EXISTS idx_assessments_status ON assessments (status, user);
+CREATE INDEX IF NOT EXISTS idx_assessments_assessor ON assessments (assessor, status);
+CREATE INDEX IF NOT EXISTS idx_assessments_role ON assessments (role);
+CREATE INDEX IF NOT EXISTS idx_assessments_timestamp ON assessments (timestamp);
+CREATE TABLE IF NOT EXISTS scores (
+    assessment INTEGER NOT NULL REFERENCES assessments (seq) ON DELETE CASCADE,
+    criterion TEXT NOT NULL,
+    score INTEGER,
+    position INTEGER,
+    PRIMARY KEY (assessment, criterion)
+);
+CREATE TABLE IF NOT EXISTS tomo_scores (
+    assessment INTEGER NOT NULL REFERENCES assessments (seq) ON DELETE CASCADE,
+    component TEXT NOT NULL,
+    score INTEGER,
+    position INTEGER,
+    PRIMARY KEY (assessment, component)
+);
+CREATE TABLE IF NOT EXISTS user_scores (
+    user TEXT NOT NULL,
+    criterion TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    position INTEGER,
+    PRIMARY KEY (user, criterion)
+);
+CREATE TABLE IF NOT EXISTS user_tomo (
+    user TEXT NOT NULL,
+    component TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    position INTEGER,
+    PRIMARY KEY (user, component)
+);
+CREATE TABLE IF NOT EXISTS history (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (scope, key, period, bucket, kind, name)
+);
+CREATE TABLE IF NOT EXISTS tomo_bins (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    bin INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (scope, key, bin)
+);
+CREATE TABLE IF NOT EXISTS user_assessors (
+    user TEXT NOT NULL,
+    assessor TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user, assessor)
+);
+"""
+
+# One row per score of each matching assessment, fanned out to every
+# (scope, period) bucket it belongs to; same buckets as history.bucket
+HISTORY_ROWS = """
+    SELECT g.scope, CASE g.scope WHEN 'user' THEN a.user ELSE a.role END AS key, p.period,
+           CASE p.period WHEN 'month' THEN substr(a.timestamp, 1, 7)
+                ELSE substr(a.timestamp, 1, 4) || '-Q' || ((CAST(substr(a.timestamp, 6, 2) AS INTEGER) + 2) / 3) END AS bucket,
+           c.kind, c.name, c.score
+    FROM assessments a
+    JOIN (SELECT 'score' AS kind, assessment, criterion AS name, score FROM scores
+          UNION ALL SELECT 'tomo', assessment, component, score FROM tomo_scores) c ON c.assessment = a.seq
+    CROSS JOIN (SELECT 'user' AS scope UNION ALL SELECT 'role') g
+    CROSS JOIN (SELECT 'month' AS period UNION ALL SELECT 'quarter') p
+    WHERE a.timestamp IS NOT NULL AND a.timestamp != '' AND (g.scope = 'user' OR a.role IS NOT NULL) AND {where}
+"""
+
+# The tables behind each derived view, and the scripts that fill
+# temp.<table>_expected with what they should hold. ToMo bins are computed in
+# Python, so their script only creates the table.
+VIEW_TABLES = {"aggregates": ("user_scores", "user_tomo", "user_assessors"), "history": ("history",), "tomo": ("tomo_bins",)}
+EXPECTED_SQL = {
+    "aggregates": """
+        DROP TABLE IF EXISTS temp.user_scores_expected;
+        DROP TABLE IF EXISTS temp.user_tomo_expected;
+        DROP TABLE IF EXISTS temp.user_assessors_expected;
+        CREATE TEMP TABLE user_scores_expected AS
+            SELECT a.user, s.criterion, SUM(s.score) AS total, COUNT(*) AS count, MIN(s.position) AS position
+            FROM scores s JOIN assessments a ON a.seq = s.assessment
+            WHERE a.status = 'Approved' GROUP BY a.user, s.criterion;
+        CREATE TEMP TABLE user_tomo_expected AS
+            SELECT a.user, t.component, SUM(t.score) AS total, COUNT(*) AS count, MIN(t.position) AS position
+            FROM tomo_scores t JOIN assessments a ON a.seq = t.assessment
+            WHERE a.status = 'Approved' GROUP BY a.user, t.component;
+        CREATE TEMP TABLE user_assessors_expected AS
+            SELECT user, assessor, COUNT(*) AS count FROM assessments
+            WHERE status = 'Approved' GROUP BY user, assessor;
+    """,
+    "history": f"""
+        DROP TABLE IF EXISTS temp.history_expected;
+        CREATE TEMP TABLE history_expected AS
+            SELECT scope, key, period, bucket, kind, name, SUM(score) AS total, COUNT(*) AS count
+            FROM ({HISTORY_ROWS.format(where="a.status IN ('Approved', 'Superseded')")})
+            GROUP BY scope, key, period, bucket, kind, name;
+    """,
+    "tomo": """
+        DROP TABLE IF EXISTS temp.tomo_bins_expected;
+        CREATE TEMP TABLE tomo_bins_expected (scope TEXT, key TEXT, bin INTEGER, count INTEGER);
+    """,
+}
+
+# Held in a thread's local storage; the connection goes back to the pool when
+# the thread ends and this is dropped
+class _Lease:
+    def __init__(self, conn):
+        self.conn = conn
+
+class SqliteRepository:
+    STORED_VIEWS = tuple(VIEW_MODULES)
+    # Idle connections kept for the next thread; any beyond this are closed
+    POOL_SIZE = 8
+
+    def __init__(self, db_file=DB_FILE, archive_dir=retention.ARCHIVE_DIR):
+        self.db_file = db_file
+        self.archive_dir = archive_dir
+        self._local = threading.local()
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        self._hierarchy = None
+
+    # One connection per thread at a time. Streamlit runs every rerun on a new
+    # thread, so a thread borrows an idle connection instead of opening one and
+    # running the schema again.
+    @property
+    def conn(self):
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            with self._pool_lock:
+                conn = self._idle.pop() if self._idle else None
+            lease = self._local.lease = _Lease(conn or self._connect())
+            weakref.finalize(lease, self._release, lease.conn)
+        return lease.conn
+
+    def _connect(self):
+        # Only ever used by one thread at a time, but not always the one that opened it
+        conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._pool_lock:
+            if len(self._idle) < self.POOL_SIZE:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    # Bumped by every write so readers can tell when derived data is stale;
+    # users_version moves only when users change
+    def _touch(self, key="version"):
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, 1) ON CONFLICT (key) DO UPDATE SET value = value + 1", (key,)
+        )
+
+    def data_version(self, key="version"):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def data_files(self):
+        return [self.db_file, self.db_file + "-wal", self.db_file + "-shm", self.archive_dir]
+
+    def load_users(self):
+        users = {}
+        for row in self.conn.execute("SELECT * FROM users"):
+            user = {"password": row["password"], "role": row["role"]}
+            if row["title"] is not None:
+                user["title"] = row["title"]
+            if row["team"] is not None:
+                user["team"] = json.loads(row["team"])
+            users[row["username"]] = user
+        return users
+
+    def load_users_versioned(self):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            return self.load_users(), self.data_version()
+
+    @diagnostics.traced("save_data")
+    def save_users(self, users, expected_version=None):
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if expected_version is not None and self.data_version() != expected_version:
+                raise VersionConflict(f"{self.db_file} changed since version {expected_version}")
+            self.conn.execute("DELETE FROM users")
+            self._touch("users_version")
+            for username, user in users.items():
+                self._put_user(username, user)
+
+    @diagnostics.traced("update_user")
+    def update_user(self, username, **fields):
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            user = self.load_users()[username]
+            user.update(fields)
+            self._put_user(username, user)
+
+    def _put_user(self, username, user):
+        team = json.dumps(user["team"]) if "team" in user else None
+        self._touch()
+        self._touch("users_version")
+        self.conn.execute(
+            "INSERT OR REPLACE INTO users (username, password, role, title, team) VALUES (?, ?, ?, ?, ?)",
+            (username, user.get("password"), user.get("role"), user.get("title"), team)
+        )
+
+    def _fetch(self, where="", params=(), tail=""):
+        rows = self.conn.execute(f"SELECT * FROM assessments {where} ORDER BY seq {tail}", params).fetchall()
+        if not rows:
+            return []
+        seqs = [row["seq"] for row in rows]
+        children = {seq: {key: {} for key in CHILD_KEYS} for seq in seqs}
+        # Children are fetched in chunks to stay under SQLite's variable limit
+        for start in range(0, len(seqs), 500):
+            chunk = seqs[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for seq, crit, score in self.conn.execute(
+                    f"SELECT assessment, criterion, score FROM scores WHERE assessment IN ({marks}) ORDER BY assessment, position", chunk):
+                children[seq]["scores"][crit] = score
+            for seq, comp, score in self.conn.execute(
+                    f"SELECT assessment, component, score FROM tomo_scores WHERE assessment IN ({marks}) ORDER BY assessment, position", chunk):
+                children[seq]["tomo_scores"][comp] = score
+        result = []
+        for row in rows:
+            assess = {key: row[key] for key in ASSESSMENT_COLUMNS if row[key] is not None}
+            assess["scores"] = children[row["seq"]]["scores"]
+            if children[row["seq"]]["tomo_scores"]:
+                assess["tomo_scores"] = children[row["seq"]]["tomo_scores"]
+            if row["extra"]:
+                assess.update(json.loads(row["extra"]))
+            result.append((row["user"], assess))
+        return result
+
+    @diagnostics.traced("load_data")
+    def load_assessments(self):
+        data = {}
+        for user, assess in self._fetch():
+            data.setdefault(user, []).append(assess)
+        return data
+
+    def user_assessments(self, user):
+        return [a for _, a in self._fetch("WHERE user = ?", (user,))]
+
+    # Keyset-paged on seq so only one chunk of rows is in memory at a time
+    def iter_assessments(self, chunk_size=1000):
+        last = 0
+        while True:
+            row = self.conn.execute(
+                "SELECT MAX(seq) FROM (SELECT seq FROM assessments WHERE seq > ? ORDER BY seq LIMIT ?)", (last, chunk_size)
+            ).fetchone()
+            if row[0] is None:
+                return
+            yield from self._fetch("WHERE seq > ? AND seq <= ?", (last, row[0]))
+            last = row[0]
+
+    def pending_assessments(self, users=None):
+        if users is None:
+            return self._fetch("WHERE status = 'Pending Approval'")
+        users = list(users)
+        result = []
+        for start in range(0, len(users), 500):
+            chunk = users[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            result.extend(self._fetch(f"WHERE status = 'Pending Approval' AND user IN ({marks})", chunk))
+        return result
+
+    def query_assessments(self, status=None, user=None, assessor=None, role=None, start=None, end=None, offset=0, limit=None):
+        clauses, params = [], []
+        low, high = timestamp_bounds(start, end)
+        for clause, value in (("status = ?", status), ("user = ?", user), ("assessor = ?", assessor),
+                              ("role = ?", role), ("timestamp >= ?", low), ("timestamp < ?", high)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        total = self.conn.execute(f"SELECT COUNT(*) FROM assessments {where}", params).fetchone()[0]
+        rows = self._fetch(where, (*params, -1 if limit is None else limit, offset), tail="LIMIT ? OFFSET ?")
+        return total, rows
+
+    def user_status_counts(self, user):
+        rows = self.conn.execute("SELECT status, COUNT(*) FROM assessments WHERE user = ? GROUP BY status", (user,))
+        return {status: count for status, count in rows}
+
+    def status_counts(self):
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*) FROM assessments "
+            "WHERE user IN (SELECT username FROM users WHERE username != 'sadmin') GROUP BY status"
+        )
+        return {status: count for status, count in rows}
+
+    # Aggregates are kept in user_scores/user_tomo/user_assessors and adjusted in the same
+    # transaction as every change to the set of approved assessments
+    def _bump(self, seq, sign):
+        self.conn.execute(
+            "INSERT INTO user_scores (user, criterion, total, count, position) "
+            "SELECT a.user, s.criterion, s.score * ?, ?, s.position FROM scores s JOIN assessments a ON a.seq = s.assessment "
+            "WHERE s.assessment = ? "
+            "ON CONFLICT (user, criterion) DO UPDATE SET total = total + excluded.total, count = count + excluded.count",
+            (sign, sign, seq)
+        )
+        self.conn.execute(
+            "INSERT INTO user_tomo (user, component, total, count, position) "
+            "SELECT a.user, t.component, t.score * ?, ?, t.position FROM tomo_scores t JOIN assessments a ON a.seq = t.assessment "
+            "WHERE t.assessment = ? "
+            "ON CONFLICT (user, component) DO UPDATE SET total = total + excluded.total, count = count + excluded.count",
+            (sign, sign, seq)
+        )
+        self.conn.execute(
+            "INSERT INTO user_assessors (user, assessor, count) SELECT user, assessor, ? FROM assessments WHERE seq = ? "
+            "ON CONFLICT (user, assessor) DO UPDATE SET count = count + excluded.count",
+            (sign, seq)
+        )
+        self._bump_tomo(seq, sign)
+        if sign < 0:
+            self.conn.execute("DELETE FROM user_scores WHERE count = 0")
+            self.conn.execute("DELETE FROM user_tomo WHERE count = 0")
+            self.conn.execute("DELETE FROM user_assessors WHERE count = 0")
+
+    # ToMo histogram bins (see tomo.py) per user, per role and for the org,
+    # whose key is ''
+    def _bump_tomo(self, seq, sign):
+        row = self.conn.execute("SELECT user, role, tomo FROM assessments WHERE seq = ?", (seq,)).fetchone()
+        tomo_scores = dict(self.conn.execute("SELECT component, score FROM tomo_scores WHERE assessment = ?", (seq,)).fetchall())
+        cols = tomo.bins({"tomo": row["tomo"], "tomo_scores": tomo_scores})
+        if not cols:
+            return
+        keys = [("org", ""), ("user", row["user"])] + ([("role", row["role"])] if row["role"] is not None else [])
+        self.conn.executemany(
+            "INSERT INTO tomo_bins (scope, key, bin, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (scope, key, bin) DO UPDATE SET count = count + excluded.count",
+            [(scope, key, col, sign) for scope, key in keys for col in cols]
+        )
+        if sign < 0:
+            self.conn.execute("DELETE FROM tomo_bins WHERE count = 0")
+
+    def _tomo(self, where="", params=(), table_suffix=""):
+        hists = {}
+        for row in self.conn.execute(f"SELECT scope, key, bin, count FROM tomo_bins{table_suffix} {where}", params):
+            counts = hists.setdefault((row["scope"], row["key"]), tomo.empty())
+            counts[row["bin"]] = row["count"]
+        return hists
+
+    def tomo_histograms(self, scope, keys=None):
+        if scope == "org":
+            return self._tomo("WHERE scope = 'org'").get(("org", ""), tomo.empty())
+        if keys is None:
+            return {key: counts for (_, key), counts in self._tomo("WHERE scope = ?", (scope,)).items()}
+        keys, hists = list(keys), {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            hists.update({key: counts for (_, key), counts in self._tomo(f"WHERE scope = ? AND key IN ({marks})", (scope, *chunk)).items()})
+        return hists
+
+    # History rows move when an assessment starts or stops counting (approved,
+    # or deleted while approved or superseded); superseding leaves them alone
+    def _bump_history(self, seq, sign):
+        self.conn.execute(
+            "INSERT INTO history (scope, key, period, bucket, kind, name, total, count) "
+            f"SELECT scope, key, period, bucket, kind, name, score * ?, ? FROM ({HISTORY_ROWS.format(where='a.seq = ?')}) WHERE 1 "
+            "ON CONFLICT (scope, key, period, bucket, kind, name) DO UPDATE SET total = total + excluded.total, count = count + excluded.count",
+            (sign, sign, seq)
+        )
+        if sign < 0:
+            self.conn.execute("DELETE FROM history WHERE count = 0")
+
+    def _history(self, table_suffix="", where="", params=()):
+        result = {}
+        for row in self.conn.execute(
+                f"SELECT scope, key, period, bucket, kind, name, total, count FROM history{table_suffix} {where} ORDER BY bucket", params):
+            agg = result.setdefault((row["scope"], row["key"], row["period"], row["bucket"]),
+                                    {"sums": {}, "counts": {}, "tomo_sums": {}, "tomo_counts": {}})
+            sums, counts = ("sums", "counts") if row["kind"] == "score" else ("tomo_sums", "tomo_counts")
+            agg[sums][row["name"]] = row["total"]
+            agg[counts][row["name"]] = row["count"]
+        return result
+
+    def history(self, scope, key, period="month", start=None, end=None):
+        clauses, params = ["scope = ?", "key = ?", "period = ?"], [scope, key, period]
+        for clause, value in (("bucket >= ?", start), ("bucket <= ?", end)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        rows = self._history(where=f"WHERE {' AND '.join(clauses)}", params=params)
+        return history.merge([{b: agg for (_, _, _, b), agg in rows.items()},
+                              retention.archived_history(scope, key, period, start, end, self.archive_dir)])
+
+    def _aggregates(self, table_suffix="", where="", params=()):
+        aggs = {}
+        for row in self.conn.execute(
+                f"SELECT user, criterion, total, count FROM user_scores{table_suffix} {where} ORDER BY user, position", params):
+            agg = aggs.setdefault(row["user"], aggregates.empty_aggregate())
+            agg["sums"][row["criterion"]] = row["total"]
+            agg["counts"][row["criterion"]] = row["count"]
+        for row in self.conn.execute(
+                f"SELECT user, component, total, count FROM user_tomo{table_suffix} {where} ORDER BY user, position", params):
+            agg = aggs.setdefault(row["user"], aggregates.empty_aggregate())
+            agg["tomo_sums"][row["component"]] = row["total"]
+            agg["tomo_counts"][row["component"]] = row["count"]
+        for row in self.conn.execute(f"SELECT user, assessor, count FROM user_assessors{table_suffix} {where}", params):
+            agg = aggs.setdefault(row["user"], aggregates.empty_aggregate())
+            agg["assessors"][row["assessor"]] = row["count"]
+            agg["approved"] += row["count"]
+        return aggs
+
+    def user_aggregate(self, user):
+        return self._aggregates(where="WHERE user = ?", params=(user,)).get(user)
+
+    # Rebuilt when users change; assessment writes leave it alone
+    def hierarchy(self):
+        version = self.data_version("users_version")
+        if self._hierarchy is None or self._hierarchy[0] != version:
+            self._hierarchy = (version, hierarchy.build(self.load_users()))
+        return self._hierarchy[1]
+
+    def _expected(self, name):
+        self.conn.executescript(EXPECTED_SQL[name])
+        if name == "tomo":
+            expected = tomo.flatten(tomo.build(self.load_assessments()))
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO temp.tomo_bins_expected (scope, key, bin, count) VALUES (?, ?, ?, ?)",
+                    [(scope, "" if key is None else key, col, n)
+                     for (scope, key), counts in expected.items() for col, n in enumerate(counts) if n]
+                )
+
+    # A view as its module's diff compares it, read from its tables or from
+    # the expected copies
+    def _stored(self, name, table_suffix=""):
+        if name == "aggregates":
+            return self._aggregates(table_suffix)
+        if name == "history":
+            return self._history(table_suffix)
+        return {key: counts.tolist() for key, counts in self._tomo(table_suffix=table_suffix).items()}
+
+    # name is one of VIEW_MODULES
+    def verify(self, name):
+        self._expected(name)
+        return VIEW_MODULES[name].diff(self._stored(name), self._stored(name, "_expected"))
+
+    def rebuild(self, name):
+        self._expected(name)
+        with self.conn:
+            for table in VIEW_TABLES[name]:
+                self.conn.execute(f"DELETE FROM {table}")
+                self.conn.execute(f"INSERT INTO {table} SELECT * FROM temp.{table}_expected")
+
+    def _insert(self, user, assessment):
+        extra = {k: v for k, v in assessment.items() if k not in ASSESSMENT_COLUMNS and k not in CHILD_KEYS}
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO assessments (id, user, assessor, assessor_name, role, status, timestamp, tomo, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (assessment_id(assessment), user, assessment.get("assessor"), assessment.get("assessor_name"),
+             assessment.get("role"), assessment.get("status", "Approved"), assessment.get("timestamp"),
+             assessment.get("tomo"), json.dumps(extra) if extra else None)
+        )
+        if cur.rowcount == 0:
+            return False
+        self._touch()
+        seq = cur.lastrowid
+        self.conn.executemany(
+            "INSERT INTO scores (assessment, criterion, score, position) VALUES (?, ?, ?, ?)",
+            [(seq, crit, score, pos) for pos, (crit, score) in enumerate(assessment.get("scores", {}).items())]
+        )
+        self.conn.executemany(
+            "INSERT INTO tomo_scores (assessment, component, score, position) VALUES (?, ?, ?, ?)",
+            [(seq, comp, score, pos) for pos, (comp, score) in enumerate(assessment.get("tomo_scores", {}).items())]
+        )
+        if assessment.get("status", "Approved") == "Approved":
+            self._bump(seq, 1)
+        if assessment.get("status", "Approved") in history.COUNTED:
+            self._bump_history(seq, 1)
+        return True
+
+    # The single-row operations below run inside the caller's transaction and
+    # return (ok, message) like storage.commit
+    def _approve(self, user, aid):
+        row = self.conn.execute("SELECT seq, assessor, status FROM assessments WHERE user = ? AND id = ?", (user, aid)).fetchone()
+        if row is None:
+            return False, "Not found"
+        if row["status"] != "Pending Approval":
+            return False, f"Already {row['status']}"
+        if row["assessor"] == "Self":
+            # A newly approved self assessment supersedes the previous one,
+            # which is kept for history
+            superseded = self.conn.execute(
+                "SELECT seq FROM assessments WHERE user = ? AND assessor = 'Self' AND status = 'Approved'", (user,)
+            ).fetchall()
+            for old in superseded:
+                self._bump(old["seq"], -1)
+                self.conn.execute("UPDATE assessments SET status = 'Superseded' WHERE seq = ?", (old["seq"],))
+        self.conn.execute("UPDATE assessments SET status = 'Approved' WHERE seq = ?", (row["seq"],))
+        self._bump(row["seq"], 1)
+        self._bump_history(row["seq"], 1)
+        self._touch()
+        return True, "Approved"
+
+    def _reject(self, user, aid):
+        row = self.conn.execute("SELECT seq, status FROM assessments WHERE user = ? AND id = ?", (user, aid)).fetchone()
+        if row is None:
+            return False, "Not found"
+        if row["status"] != "Pending Approval":
+            return False, f"Already {row['status']}"
+        self.conn.execute("UPDATE assessments SET status = 'Rejected' WHERE seq = ?", (row["seq"],))
+        self._touch()
+        return True, "Rejected"
+
+    def _delete(self, user, aid):
+        row = self.conn.execute("SELECT seq, status FROM assessments WHERE user = ? AND id = ?", (user, aid)).fetchone()
+        if row is None:
+            return False, "Not found"
+        if row["status"] == "Approved":
+            self._bump(row["seq"], -1)
+        if row["status"] in history.COUNTED:
+            self._bump_history(row["seq"], -1)
+        self.conn.execute("DELETE FROM assessments WHERE seq = ?", (row["seq"],))
+        self._touch()
+        return True, "Deleted"
+
+    def submit(self, user, assessment):
+        with self.conn:
+            return (True, "Submitted") if self._insert(user, assessment) else (False, "Already submitted")
+
+    def approve(self, user, aid):
+        with self.conn:
+            return self._approve(user, aid)
+
+    def reject(self, user, aid):
+        with self.conn:
+            return self._reject(user, aid)
+
+    def delete(self, user, aid):
+        with self.conn:
+            return self._delete(user, aid)
+
+    def bulk(self, actions):
+        actions = list(actions)
+        handlers = {"approve": self._approve, "reject": self._reject, "delete": self._delete}
+        with self.conn:
+            results = [handlers[action](user, aid) for action, user, aid in actions]
+        return bulk_results(actions, results)
+
+    def commit(self, ops):
+        handlers = {
+            "add": lambda op: (True, "Submitted") if self._insert(op["user"], op["assessment"]) else (False, "Already submitted"),
+            "approve": lambda op: self._approve(op["user"], op["id"]),
+            "reject": lambda op: self._reject(op["user"], op["id"]),
+            "delete": lambda op: self._delete(op["user"], op["id"]),
+            # UNIQUE (user, id) means there is never a second copy to drop
+            "dedupe": lambda op: (False, "No duplicates"),
+        }
+        with self.conn:
+            return [handlers[op["op"]](op) for op in ops]
+
+    def compact(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def migrate(db_file=DB_FILE, data_file=DATA_FILE, users_file=USERS_FILE):
+    repo = SqliteRepository(db_file)
+    users = storage.read_data(users_file)
+    data = storage.read_data(data_file)
+    imported = 0
+    with repo.conn:
+        for username, user in users.items():
+            repo._put_user(username, user)
+        for user, assessments in data.items():
+            for assess in assessments:
+                imported += repo._insert(user, assess)
+    return len(users), imported
+
+_repository = None
+
+def get_repository():
+    global _repository
+    if _repository is None:
+        backend = os.environ.get("PEAKDESIGNER_BACKEND", "json")
+        if backend == "sqlite":
+            _repository = SqliteRepository()
+        elif backend == "sharded":
+            _repository = ShardedRepository()
+        else:
+            _repository = JsonRepository()
+    return _repository
+
+if __name__ == "__main__":
+    # python repository.py migrate [db_file] [data_file] [users_file]
+    # python repository.py shard [shard_dir] [data_file]
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "shard"):
+        print("usage: python repository.py migrate [db_file] [data_file] [users_file]")
+        print("       python repository.py shard [shard_dir] [data_file]")
+        sys.exit(1)
+    if sys.argv[1] == "migrate":
+        n_users, n_assessments = migrate(*sys.argv[2:5])
+        print(f"Imported {n_users} users and {n_assessments} assessments")
+    else:
+        n_users, n_assessments = migrate_shards(*sys.argv[2:4])
+        print(f"Sharded {n_assessments} assessments across {n_users} users")
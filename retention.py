@@ -0,0 +1,174 @@
+import gzip
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+import storage
+import history
+from storage import assessment_id, thaw
+
+ARCHIVE_DIR = os.environ.get("PEAKDESIGNER_ARCHIVE", "archive")
+# Rejected and superseded assessments stay hot this long after submission
+MIN_AGE_DAYS = int(os.environ.get("PEAKDESIGNER_RETENTION_DAYS", 30))
+ARCHIVED_STATUSES = ("Rejected", "Superseded")
+BATCH_SIZE = 1000
+
+# Cold storage is a directory of gzip segments, one per quarter of submission
+# time. Each archive run appends a new gzip member to the segments it touches
+# and never rewrites them. Records are
+# {"user", "reason", "archived_at", "assessment"} with reason "rejected",
+# "superseded" or "duplicate".
+def segment_name(timestamp):
+    if not timestamp:
+        return "assessments-undated.jsonl.gz"
+    return f"assessments-{history.bucket(timestamp, 'quarter')}.jsonl.gz"
+
+def segment_quarter(name):
+    return name[len("assessments-"):-len(".jsonl.gz")]
+
+def segments(archive_dir=ARCHIVE_DIR):
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(name for name in os.listdir(archive_dir) if name.startswith("assessments-") and name.endswith(".jsonl.gz"))
+
+# Archived superseded assessments still belong in the trend history, so their
+# rollups are kept here and merged into reads
+def rollup_file(archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, "history.json")
+
+def _lock(archive_dir):
+    return storage.file_lock(os.path.join(archive_dir, "segments"))
+
+def append_segment(path, records):
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+            gz.write("".join(json.dumps(r) + "\n" for r in records).encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def read_segment(path):
+    with gzip.open(path, 'rt', encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile):
+            # A member torn by a crash mid-append; everything before it is intact
+            return
+
+# (op, records) pairs for everything that should leave the hot store. Duplicate
+# detection relies on iter_assessments yielding each user's list together,
+# which holds for the JSON stores; SQLite can't hold duplicates.
+def candidates(repo, cutoff, archived_at):
+    user, seen = None, set()
+    planned = {}
+    for owner, assess in repo.iter_assessments():
+        if owner != user:
+            user, seen = owner, set()
+        aid = assessment_id(assess)
+        status = assess.get('status', 'Approved')
+        duplicate = aid in seen
+        seen.add(aid)
+        if status in ARCHIVED_STATUSES and (assess.get('timestamp') or "") < cutoff:
+            op = ("delete", owner, aid)
+        elif duplicate:
+            op = ("dedupe", owner, aid)
+        else:
+            continue
+        reason = "duplicate" if duplicate else status.lower()
+        planned.setdefault(op, []).append({"user": owner, "reason": reason, "archived_at": archived_at,
+                                           "assessment": thaw(assess)})
+    return [({"op": kind, "user": owner, "id": aid}, records) for (kind, owner, aid), records in planned.items()]
+
+def archive(repo, min_age_days=MIN_AGE_DAYS, now=None):
+    archive_dir = repo.archive_dir
+    now = now or datetime.now()
+    cutoff = (now - timedelta(days=min_age_days)).isoformat()
+    os.makedirs(archive_dir, exist_ok=True)
+    with _lock(archive_dir):
+        plan = candidates(repo, cutoff, now.isoformat())
+        # Segments are written and synced before anything leaves the hot store;
+        # a crash in between only leaves records that a re-run archives again
+        by_segment = {}
+        for _, records in plan:
+            for record in records:
+                by_segment.setdefault(segment_name(record["assessment"].get("timestamp")), []).append(record)
+        for name, records in by_segment.items():
+            append_segment(os.path.join(archive_dir, name), records)
+
+        applied = []
+        for start in range(0, len(plan), BATCH_SIZE):
+            chunk = plan[start:start + BATCH_SIZE]
+            for (op, records), (ok, _) in zip(chunk, repo.commit([op for op, _ in chunk])):
+                if ok:
+                    applied.extend(records)
+
+        # Only records the history view counted move into the rollup; an
+        # undated superseded record was never in it
+        superseded = [r for r in applied if r["reason"] == "superseded" and history.is_counted(r["assessment"])]
+        if superseded:
+            state = thaw(storage.load_data(rollup_file(archive_dir))) or {"user": {}, "role": {}}
+            for record in superseded:
+                history.add(state, record["user"], record["assessment"], shared=False)
+            storage.save_data(state, rollup_file(archive_dir))
+    if applied:
+        repo.compact()
+    return {"archived": len(applied), "segments": sorted(by_segment)}
+
+def iter_records(archive_dir=ARCHIVE_DIR, start=None, end=None):
+    low = history.bucket(start.isoformat(), "quarter") if start else None
+    high = history.bucket(end.isoformat(), "quarter") if end else None
+    seen = set()
+    for name in segments(archive_dir):
+        quarter = segment_quarter(name)
+        if (low or high) and (quarter == "undated" or (low and quarter < low) or (high and quarter > high)):
+            continue
+        for record in read_segment(os.path.join(archive_dir, name)):
+            # A run interrupted before its hot-store commit archives records twice
+            key = (record["user"], assessment_id(record["assessment"]), record["reason"])
+            if key not in seen:
+                seen.add(key)
+                yield record
+
+def query(archive_dir=ARCHIVE_DIR, user=None, reason=None, start=None, end=None, offset=0, limit=None):
+    low = start.isoformat() if start else None
+    high = (end + timedelta(days=1)).isoformat() if end else None
+    total, page = 0, []
+    for record in iter_records(archive_dir, start, end):
+        stamp = record["assessment"].get("timestamp") or ""
+        if (user is not None and record["user"] != user) or (reason is not None and record["reason"] != reason):
+            continue
+        if (low is not None and stamp < low) or (high is not None and stamp >= high):
+            continue
+        if total >= offset and (limit is None or len(page) < limit):
+            page.append(record)
+        total += 1
+    return total, page
+
+def archived_history(scope, key, period="month", start=None, end=None, archive_dir=ARCHIVE_DIR):
+    return history.read(storage.load_data(rollup_file(archive_dir)), scope, key, period, start, end)
+
+def rebuild_rollup(archive_dir=ARCHIVE_DIR):
+    os.makedirs(archive_dir, exist_ok=True)
+    with _lock(archive_dir):
+        state = {"user": {}, "role": {}}
+        for record in iter_records(archive_dir):
+            if record["reason"] == "superseded" and history.is_counted(record["assessment"]):
+                history.add(state, record["user"], record["assessment"], shared=False)
+        storage.save_data(state, rollup_file(archive_dir))
+
+if __name__ == "__main__":
+    # python retention.py run [min_age_days]
+    # python retention.py rebuild
+    from repository import get_repository
+    if len(sys.argv) < 2 or sys.argv[1] not in ("run", "rebuild"):
+        print("usage: python retention.py run [min_age_days]")
+        print("       python retention.py rebuild")
+        sys.exit(1)
+    repo = get_repository()
+    if sys.argv[1] == "run":
+        summary = archive(repo, int(sys.argv[2]) if len(sys.argv) > 2 else MIN_AGE_DAYS)
+        print(f"Archived {summary['archived']} assessments into {len(summary['segments'])} segment(s)")
+    else:
+        rebuild_rollup(repo.archive_dir)
+        print("Archived history rebuilt")
@@ -0,0 +1,437 @@
+import json
+import os
+import threading
+import hashlib
+import uuid
+from contextlib import contextmanager
+from types import MappingProxyType
+import diagnostics
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within the process
+    fcntl = None
+
+DATA_FILE = "assessments.json"
+USERS_FILE = "users.json"
+
+# Once the journal grows past this many bytes it is folded into the snapshot
+COMPACT_THRESHOLD = int(os.environ.get("PEAKDESIGNER_COMPACT_BYTES", 1024 * 1024))
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+_compact_lock = threading.Lock()
+
+# Parsed files shared by every session in the process, keyed on file stats
+# plus a counter bumped by our own writes
+_cache = {}
+_cache_lock = threading.Lock()
+_versions = {}
+
+# Derived views (aggregates and the like) live next to the cached data. They
+# are built once per cache fill and then patched per user as ops are recorded.
+_views = {}
+_view_locks = {}
+
+class VersionConflict(Exception):
+    pass
+
+def journal_path(file):
+    return file + ".log"
+
+def version_path(file):
+    return file + ".version"
+
+def lock_path(file):
+    return file + ".lock"
+
+# Serializes writers of one data file: a thread lock within the process and an
+# advisory flock across processes. Not reentrant.
+@contextmanager
+def file_lock(file):
+    with _thread_locks_lock:
+        lock = _thread_locks.setdefault(file, threading.Lock())
+    with diagnostics.span("lock_wait", file=file):
+        lock.acquire()
+    try:
+        with open(lock_path(file), 'a') as f:
+            if fcntl is not None:
+                with diagnostics.span("flock_wait", file=file):
+                    fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        lock.release()
+
+def _fsync_dir(path):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Readers either see the old file or the new one, never a partial write
+def atomic_write(file, text, durable=True):
+    tmp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, file)
+    if durable:
+        _fsync_dir(file)
+
+def document_version(file):
+    try:
+        with open(version_path(file), 'r') as f:
+            return int(f.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+def _bump_document_version(file):
+    version = document_version(file) + 1
+    atomic_write(version_path(file), str(version), durable=False)
+    return version
+
+def compacting_path(file):
+    return file + ".log.compacting"
+
+def new_assessment_id():
+    return uuid.uuid4().hex
+
+def assessment_id(assess):
+    # Assessments written before ids existed get one derived from their content
+    if 'id' in assess:
+        return assess['id']
+    m = hashlib.md5()
+    m.update(f"{assess.get('assessor', '')}|{assess.get('assessor_name', '')}|{assess.get('timestamp', '')}".encode('utf-8'))
+    return m.hexdigest()[:16]
+
+def find_assessment(data, user, aid):
+    for assess in data.get(user, []):
+        if assessment_id(assess) == aid:
+            return assess
+    return None
+
+# Journal operations. Every op is idempotent so replaying a journal on top of a
+# snapshot that already contains some of it gives the same result.
+def apply_op(data, op):
+    user = op['user']
+    kind = op['op']
+    if kind == "add":
+        assess = op['assessment']
+        if find_assessment(data, user, assessment_id(assess)) is not None:
+            return False
+        data.setdefault(user, []).append(assess)
+        return True
+    if kind == "put":
+        # Plain key/value write, used for user records and small index files such as shard manifests.
+        # A versioned put only lands over an older version, so a slow writer
+        # can't overwrite a newer value and replays stay idempotent.
+        current = data.get(user)
+        if 'version' in op and current and current.get('version', -1) >= op['version']:
+            return False
+        data[user] = op['value']
+        return True
+    if kind == "dedupe":
+        # Drops all but the first copy of an assessment appended more than once
+        copies = [a for a in data.get(user, ()) if assessment_id(a) == op['id']]
+        if len(copies) < 2:
+            return False
+        data[user] = [a for a in data[user] if a is copies[0] or assessment_id(a) != op['id']]
+        return True
+    if kind == "delete":
+        if find_assessment(data, user, op['id']) is None:
+            return False
+        data[user] = [a for a in data[user] if assessment_id(a) != op['id']]
+        if not data[user]:
+            del data[user]
+        return True
+    assess = find_assessment(data, user, op['id'])
+    if assess is None or assess.get('status') != 'Pending Approval':
+        return False
+    if kind == "approve":
+        if assess['assessor'] == "Self":
+            # A newly approved self assessment supersedes the previous one,
+            # which is kept for history
+            for other in data[user]:
+                if other is not assess and other['assessor'] == "Self" and other.get('status', 'Approved') == 'Approved':
+                    other['status'] = "Superseded"
+        assess['status'] = "Approved"
+        return True
+    if kind == "reject":
+        assess['status'] = "Rejected"
+        return True
+    raise ValueError(f"Unknown journal op: {kind}")
+
+def read_journal(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Torn final line from an interrupted append
+                return
+
+def load_snapshot(file):
+    if os.path.exists(file):
+        with open(file, 'r') as f:
+            return json.load(f)
+    return {}
+
+def read_data(file):
+    # Reads take no lock, so a compaction or full save can swap the snapshot or
+    # move the journal between the reads below. The read is retried until the
+    # snapshot and compacting journal it started from are still in place.
+    while True:
+        before = (_stat(file), _stat(compacting_path(file)))
+        data = load_snapshot(file)
+        for path in (compacting_path(file), journal_path(file)):
+            for op in read_journal(path):
+                apply_op(data, op)
+        if (_stat(file), _stat(compacting_path(file))) == before:
+            return data
+
+# Cached data is shared between sessions, so it is handed out read-only:
+# dicts become mapping proxies and lists become tuples.
+def freeze(obj):
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+def thaw(obj):
+    if isinstance(obj, (dict, MappingProxyType)):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(v) for v in obj]
+    return obj
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+# mtimes only move once per clock tick, so the document version is part of the key
+def data_version(file):
+    return (_versions.get(file, 0), document_version(file), _stat(file),
+            _stat(compacting_path(file)), _stat(journal_path(file)))
+
+def invalidate(file):
+    with _cache_lock:
+        _versions[file] = _versions.get(file, 0) + 1
+        _cache.pop(file, None)
+
+def _entry(file):
+    key = data_version(file)
+    entry = _cache.get(file)
+    if entry is not None and entry['key'] == key:
+        diagnostics.count("data_cache:hit")
+        return entry
+    diagnostics.count("data_cache:miss")
+    # The version is read before the data, so a write racing this read can only
+    # make the entry look older than it is
+    version = document_version(file)
+    with diagnostics.span("load_data", file=file):
+        data = freeze(read_data(file))
+    entry = {'key': key, 'version': version, 'data': data, 'views': {}}
+    with _cache_lock:
+        _cache[file] = entry
+    return entry
+
+def load_data(file):
+    return _entry(file)['data']
+
+def load_versioned(file):
+    entry = _entry(file)
+    return entry['data'], entry['version']
+
+def register_view(name, build, update):
+    # build(data) -> state; update(state, user, before, after) patches one user
+    _views[name] = (build, update)
+
+def load_view(file, name):
+    entry = _entry(file)
+    if name in entry['views']:
+        diagnostics.count("view_cache:hit")
+        return entry['views'][name]
+    with _thread_locks_lock:
+        lock = _view_locks.setdefault(file, threading.Lock())
+    with lock:
+        # Another session may have built it while this one waited
+        entry = _entry(file)
+        if name in entry['views']:
+            diagnostics.count("view_cache:hit")
+            return entry['views'][name]
+        diagnostics.count("view_cache:miss")
+        with diagnostics.span(f"build_view:{name}"):
+            state = _views[name][0](entry['data'])
+        with _cache_lock:
+            # A write that patched the cache during the build moved on to a new
+            # entry; the view is right for the data it was built from but is
+            # not kept, so the new entry builds its own
+            if _cache.get(file) is entry:
+                entry['views'][name] = state
+    return state
+
+def reset_view(file, name):
+    entry = _entry(file)
+    with _cache_lock:
+        entry['views'].pop(name, None)
+
+# Caller holds _cache_lock, which also guards the views dicts
+def _patch_entry(entry, ops, key, version):
+    data = dict(entry['data'])
+    views = dict(entry['views'])
+    for op in ops:
+        user = op['user']
+        before = data.get(user, ())
+        changed = {user: thaw(before)}
+        apply_op(changed, op)
+        after = freeze(changed[user]) if user in changed else ()
+        if after:
+            data[user] = after
+        else:
+            data.pop(user, None)
+        for name, state in views.items():
+            _views[name][1](state, user, before, after)
+    return {'key': key, 'version': version, 'data': MappingProxyType(data), 'views': views}
+
+def _write_locked(data, file):
+    # Caller holds file_lock(file)
+    atomic_write(file, json.dumps(data, indent=4, default=dict))
+    # data is the full state, so anything still journaled is already in it
+    for path in (compacting_path(file), journal_path(file)):
+        if os.path.exists(path):
+            os.remove(path)
+    _bump_document_version(file)
+
+# With expected_version (from load_versioned), a writer whose copy is stale
+# gets VersionConflict and can reload and retry instead of clobbering data
+@diagnostics.traced("save_data")
+def save_data(data, file, expected_version=None):
+    with file_lock(file):
+        if expected_version is not None and document_version(file) != expected_version:
+            raise VersionConflict(f"{file} changed since version {expected_version}")
+        _write_locked(data, file)
+    invalidate(file)
+
+# Field updates read the current record under the lock, so they never
+# conflict, and are journaled so views over the users file are patched
+# rather than rebuilt
+@diagnostics.traced("update_user")
+def update_user(username, file=USERS_FILE, **fields):
+    with file_lock(file):
+        user = thaw(load_data(file)[username])
+        user.update(fields)
+        size = _append(file, [{"op": "put", "user": username, "value": user}])
+    _maybe_compact(file, size)
+
+OP_RESULTS = {"add": "Submitted", "approve": "Approved", "reject": "Rejected", "delete": "Deleted", "put": "Updated",
+              "dedupe": "Deduplicated"}
+
+def _append(file, ops):
+    # Caller holds file_lock(file)
+    lines = "".join(json.dumps(op) + "\n" for op in ops)
+    before = data_version(file)
+    with open(journal_path(file), 'a') as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    size = os.path.getsize(journal_path(file))
+    version = _bump_document_version(file)
+    with _cache_lock:
+        _versions[file] = _versions.get(file, 0) + 1
+        entry = _cache.pop(file, None)
+        # Patch the cached copy in place of a full re-read when it was current
+        if entry is not None and entry['key'] == before:
+            _cache[file] = _patch_entry(entry, ops, data_version(file), version)
+    return size
+
+def _maybe_compact(file, size):
+    if size > COMPACT_THRESHOLD and not _compact_lock.locked():
+        threading.Thread(target=compact, args=(file,), daemon=True).start()
+
+# Applies a batch against the current data and journals only the ops that take
+# effect, in a single append. Returns (ok, message) per op.
+@diagnostics.traced("commit")
+def commit(file, ops):
+    return commit_changes(file, ops)[0]
+
+# commit, plus {user: (before, after)} for every user an applied op touched and
+# the file's document version after the write, all read under the write's lock
+def commit_changes(file, ops):
+    results, applied, scratch = [], [], {}
+    with file_lock(file):
+        data = load_data(file)
+        for op in ops:
+            user = op['user']
+            if user not in scratch:
+                scratch[user] = thaw(data.get(user, ()))
+            view = {user: scratch[user]}
+            if apply_op(view, op):
+                applied.append(op)
+                results.append((True, OP_RESULTS[op['op']]))
+            elif op['op'] == "add":
+                results.append((False, "Already submitted"))
+            elif op['op'] == "dedupe":
+                results.append((False, "No duplicates"))
+            elif op['op'] == "put":
+                results.append((False, "Outdated"))
+            else:
+                assess = find_assessment(view, user, op['id'])
+                results.append((False, "Not found" if assess is None else f"Already {assess.get('status', 'Approved')}"))
+            scratch[user] = view.get(user, [])
+        changes = {op['user']: (data.get(op['user'], ()), scratch[op['user']]) for op in applied}
+        size = _append(file, applied) if applied else 0
+        version = document_version(file)
+    _maybe_compact(file, size)
+    return results, changes, version
+
+def compact(file):
+    if not _compact_lock.acquire(blocking=False):
+        return
+    try:
+        pending = compacting_path(file)
+        with file_lock(file):
+            # A leftover file from an interrupted compaction is finished first
+            if not os.path.exists(pending) and os.path.exists(journal_path(file)):
+                os.replace(journal_path(file), pending)
+            if not os.path.exists(pending):
+                return
+            snapshot_stat = _stat(file)
+        # The snapshot is rebuilt without holding the lock so writers keep appending
+        data = load_snapshot(file)
+        for op in read_journal(pending):
+            apply_op(data, op)
+        text = json.dumps(data, indent=4)
+        with file_lock(file):
+            # Skip if a full save (or another worker's compaction) got there first
+            if os.path.exists(pending) and _stat(file) == snapshot_stat:
+                atomic_write(file, text)
+                os.remove(pending)
+        invalidate(file)
+    finally:
+        _compact_lock.release()
+
+def submit_assessment(user, assessment, file=DATA_FILE):
+    return commit(file, [{"op": "add", "user": user, "assessment": assessment}])[0]
+
+def approve_assessment(user, aid, file=DATA_FILE):
+    return commit(file, [{"op": "approve", "user": user, "id": aid}])[0]
+
+def reject_assessment(user, aid, file=DATA_FILE):
+    return commit(file, [{"op": "reject", "user": user, "id": aid}])[0]
+
+def delete_assessment(user, aid, file=DATA_FILE):
+    return commit(file, [{"op": "delete", "user": user, "id": aid}])[0]
@@ -0,0 +1,101 @@
+import http.client
+import json
+import threading
+import pytest
+import storage
+
+pytest.importorskip("numpy")
+import api
+import repository
+from repository import JsonRepository
+from constants import CRITERIA_NAMES
+
+USERS = {"sadmin": {"password": "x", "role": "Superadmin"},
+         "mia": {"password": "x", "role": "Manager", "title": "Lead Product Designer", "team": ["ann", "bob"]},
+         "ann": {"password": "x", "role": "User", "title": "Product Designer"},
+         "bob": {"password": "x", "role": "User", "title": "Product Designer"}}
+
+def pending(aid, timestamp="2025-01-05T10:00:00"):
+    return {"id": aid, "assessor": "Peer", "role": "Product Designer", "status": "Pending Approval", "timestamp": timestamp,
+            "scores": dict.fromkeys(CRITERIA_NAMES["Product Designer"], 3)}
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    users = str(tmp_path / "users.json")
+    storage.save_data(USERS, users)
+    repo = JsonRepository(str(tmp_path / "data.json"), users, str(tmp_path / "archive"))
+    monkeypatch.setattr(repository, "_repository", repo)
+    return repo
+
+@pytest.fixture
+def call(repo):
+    server = api.PooledHTTPServer(("127.0.0.1", 0), workers=2)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def call(method, path, body=None, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers or {})
+        response = conn.getresponse()
+        raw = response.read()
+        conn.close()
+        return response.status, dict(response.getheaders()), json.loads(raw) if raw else None
+    yield call
+    server.shutdown()
+    server.server_close()
+
+def test_unknown_paths_and_methods(call):
+    assert call("GET", "/nope")[0] == 404
+    status, headers, body = call("POST", "/stats", {})
+    assert (status, headers["Allow"], body) == (405, "GET", {"error": "method not allowed"})
+    assert call("GET", "/users/zed/aggregate")[0] == 404
+
+def test_etag_answers_304_until_data_changes(repo, call):
+    status, headers, body = call("GET", "/stats")
+    assert status == 200 and body["users"] == 3 and body["managers"] == 1
+    tag = headers["ETag"]
+    status, _, body = call("GET", "/stats", headers={"If-None-Match": tag})
+    assert (status, body) == (304, None)
+    repo.submit("ann", pending("a1"))
+    status, headers, body = call("GET", "/stats", headers={"If-None-Match": tag})
+    assert status == 200 and headers["ETag"] != tag and body["status_counts"] == {"Pending Approval": 1}
+
+def test_pending_pages(repo, call):
+    for i in range(5):
+        repo.submit("ann" if i % 2 else "bob", pending(f"a{i}"))
+    status, _, body = call("GET", "/managers/mia/pending?offset=1&limit=3")
+    assert status == 200
+    assert (body["total"], body["offset"], body["limit"]) == (5, 1, 3)
+    assert [item["id"] for item in body["items"]] == ["a3", "a0", "a2"]
+    for query in ("offset=-1", "limit=0", f"limit={api.MAX_LIMIT + 1}", "limit=ten"):
+        assert call("GET", f"/managers/mia/pending?{query}")[0] == 400
+
+def test_post_assessment(repo, call):
+    body = {"assessor": "Peer", "id": "p1", "role": "Product Designer", "timestamp": "2025-01-05",
+            "scores": dict.fromkeys(CRITERIA_NAMES["Product Designer"], 4)}
+    status, _, created = call("POST", "/users/ann/assessments", body)
+    assert (status, created) == (201, {"user": "ann", "id": "p1", "status": "Pending Approval"})
+    assert repo.user_assessments("ann")[0]["timestamp"] == "2025-01-05T00:00:00"
+    assert call("POST", "/users/ann/assessments", body)[0] == 409
+
+@pytest.mark.parametrize("fields", [{"assessor_name": 5}, {"id": ["a"]}, {"timestamp": 20250105},
+                                    {"timestamp": "2024-W01-1"}, {"scores": {"Juggling": 3}}, {"role": "Astronaut"}])
+def test_post_rejects_invalid_bodies(repo, call, fields):
+    body = {"assessor": "Peer", "role": "Product Designer", "timestamp": "2025-01-05",
+            "scores": dict.fromkeys(CRITERIA_NAMES["Product Designer"], 4), **fields}
+    status, _, payload = call("POST", "/users/ann/assessments", body)
+    assert status == 400 and payload["error"]
+    assert not repo.user_assessments("ann")
+
+def test_unexpected_errors_answer_500(repo, call, monkeypatch):
+    def broken(self):
+        raise RuntimeError("disk on fire")
+    monkeypatch.setattr(JsonRepository, "status_counts", broken)
+    status, headers, body = call("GET", "/stats")
+    assert (status, body) == (500, {"error": "internal server error"})
+    assert headers["Content-Type"] == "application/json"
+
+def test_bearer_token(call, monkeypatch):
+    monkeypatch.setattr(api, "TOKEN", "s3cret")
+    status, headers, _ = call("GET", "/stats")
+    assert status == 401 and headers["WWW-Authenticate"] == "Bearer"
+    assert call("GET", "/stats", headers={"Authorization": "Bearer s3cret"})[0] == 200
@@ -0,0 +1,33 @@
+import random
+import hierarchy
+
+def patched(users, user, team):
+    before = users.get(user)
+    users[user] = dict(before or {}, team=team)
+    return before, users[user]
+
+def snapshot(index, users):
+    return (dict(index["reports"]), dict(index["manager_of"]),
+            {m: hierarchy.subtree(index, m) for m in users})
+
+def test_subtree_follows_a_change_below_a_second_team():
+    users = {"alice": {"team": ["carol"]}, "bob": {"team": ["carol"]}, "carol": {"team": ["dave"]}, "dave": {}, "erin": {}}
+    index = hierarchy.build(users)
+    assert hierarchy.subtree(index, "bob") == {"carol", "dave"}
+    hierarchy.update(index, "carol", *patched(users, "carol", ["dave", "erin"]))
+    assert hierarchy.subtree(index, "bob") == {"carol", "dave", "erin"}
+    assert hierarchy.subtree(index, "alice") == {"carol", "dave", "erin"}
+
+def test_patched_index_matches_a_rebuild():
+    rnd = random.Random(7)
+    names = [f"u{i}" for i in range(8)]
+    users = {name: {} for name in names}
+    index = hierarchy.build(users)
+    for _ in range(300):
+        # Read every subtree so there is a warm cache for the next change to invalidate
+        for name in names:
+            hierarchy.subtree(index, name)
+        user = rnd.choice(names)
+        team = rnd.sample([n for n in names if n != user], rnd.randint(0, 3))
+        hierarchy.update(index, user, *patched(users, user, team))
+        assert snapshot(index, users) == snapshot(hierarchy.build(users), users)
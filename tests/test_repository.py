@@ -0,0 +1,101 @@
+import pytest
+import storage
+
+pytest.importorskip("numpy")
+import aggregates
+import history
+import tomo
+import repository
+from repository import JsonRepository, ShardedRepository
+
+def assessment(aid, status="Pending Approval", tomo_scores=None):
+    assess = {"id": aid, "assessor": "Peer", "role": "Product Designer", "scores": {"Craft": 3},
+              "timestamp": "2025-01-01T00:00:00", "status": status}
+    if tomo_scores:
+        assess.update(tomo=tomo_scores["play"] + tomo_scores["purpose"] + tomo_scores["potential"]
+                      - tomo_scores["emotional"] - tomo_scores["economic"] - tomo_scores["inertia"],
+                      tomo_scores=tomo_scores)
+    return assess
+
+@pytest.fixture
+def sharded(tmp_path):
+    users = str(tmp_path / "users.json")
+    storage.save_data({"ann": {"role": "User", "title": "Product Designer"}}, users)
+    return ShardedRepository(str(tmp_path / "shards"), users, str(tmp_path / "archive"))
+
+def test_slow_manifest_write_keeps_newer_counts(sharded, monkeypatch):
+    real_commit = storage.commit
+    raced = []
+
+    def overtaken(file, ops):
+        if file == sharded.manifest_file and not raced:
+            # A second writer for the same user finishes first
+            raced.append(True)
+            sharded.submit("ann", assessment("a2"))
+        return real_commit(file, ops)
+    monkeypatch.setattr(storage, "commit", overtaken)
+    sharded.submit("ann", assessment("a1"))
+    assert raced
+    assert sharded.manifest()["ann"]["counts"] == aggregates.count_statuses(sharded.user_assessments("ann"))
+    assert [a["id"] for _, a in sharded.pending_assessments(["ann"])] == ["a1", "a2"]
+
+def test_manifest_counts_follow_commits(sharded):
+    sharded.submit("ann", assessment("a1"))
+    sharded.submit("ann", assessment("a2"))
+    sharded.approve("ann", "a1")
+    sharded.reject("ann", "a2")
+    assert sharded.manifest()["ann"]["counts"] == {"Approved": 1, "Rejected": 1}
+    assert sharded.status_counts() == {"Approved": 1, "Rejected": 1}
+
+def test_tomo_histograms_read_only_the_manifest(sharded, monkeypatch):
+    scores = {"play": 6, "purpose": 5, "potential": 4, "emotional": 2, "economic": 3, "inertia": 1}
+    sharded.submit("ann", assessment("a1", tomo_scores=scores))
+    sharded.submit("ann", assessment("a2", tomo_scores=scores))
+    sharded.approve("ann", "a1")
+    expected = tomo.build({"ann": sharded.user_assessments("ann")})
+    storage.invalidate(sharded.shard_file("ann"))
+    storage.invalidate(sharded.manifest_file)
+    read = []
+    real_read_data = storage.read_data
+    monkeypatch.setattr(storage, "read_data", lambda file: read.append(file) or real_read_data(file))
+    assert tomo.flatten({"user": sharded.tomo_histograms("user"), "role": sharded.tomo_histograms("role"),
+                         "org": sharded.tomo_histograms("org")}) == tomo.flatten(expected)
+    assert read == [sharded.manifest_file]
+    assert sharded.verify("tomo") == []
+
+def test_verify_in_process_finds_a_drifted_view(tmp_path):
+    users = str(tmp_path / "users.json")
+    storage.save_data({"ann": {"role": "User", "title": "Product Designer"}}, users)
+    repo = JsonRepository(str(tmp_path / "data.json"), users, str(tmp_path / "archive"))
+    repo.submit("ann", assessment("a1", status="Approved"))
+    assert repo.verify("aggregates") == []
+    # Stands in for an incremental update that went wrong
+    storage.load_view(repo.data_file, "aggregates")["ann"]["sums"]["Craft"] += 1
+    assert [user for user, _, _ in repo.verify("aggregates")] == ["ann"]
+    repo.rebuild("aggregates")
+    assert repo.verify("aggregates") == []
+
+def test_view_cli_says_when_there_is_nothing_to_check(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(repository, "_repository", JsonRepository(str(tmp_path / "data.json"), str(tmp_path / "users.json")))
+    repository.view_cli("aggregates", ["aggregates.py", "verify"])
+    assert capsys.readouterr().out.startswith("Nothing to verify: JsonRepository keeps aggregates in each process's memory")
+
+def test_role_history_reads_only_the_manifest(sharded, monkeypatch):
+    storage.save_data({"ann": {"role": "User", "title": "Product Designer"}, "bob": {"role": "User", "title": "Product Designer"}},
+                      sharded.users_file)
+    sharded.submit("ann", assessment("a1", status="Approved"))
+    sharded.submit("bob", dict(assessment("b1", status="Approved"), timestamp="2025-02-01T00:00:00"))
+    sharded.submit("bob", assessment("b2"))
+    sharded.approve("bob", "b2")
+    sharded.delete("ann", "a1")
+    expected = history.build(sharded.load_assessments())
+    for file in [sharded.manifest_file] + sharded._shard_files():
+        storage.invalidate(file)
+    read = []
+    real_read_data = storage.read_data
+    monkeypatch.setattr(storage, "read_data", lambda file: read.append(file) or real_read_data(file))
+    for period in history.PERIODS:
+        assert sharded.history("role", "Product Designer", period) == history.read(expected, "role", "Product Designer", period)
+    # The archive rollup is read too, but no shard is
+    assert [file for file in read if file.startswith(sharded.shard_dir)] == [sharded.manifest_file]
+    assert sharded.verify("history") == []
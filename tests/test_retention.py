@@ -0,0 +1,30 @@
+import os
+from datetime import datetime
+import pytest
+import storage
+
+pytest.importorskip("numpy")
+import retention
+from repository import JsonRepository
+
+@pytest.fixture
+def repo(tmp_path):
+    users = str(tmp_path / "users.json")
+    storage.save_data({"ann": {"role": "User", "title": "Product Designer"}}, users)
+    return JsonRepository(str(tmp_path / "data.json"), users, str(tmp_path / "archive"))
+
+def superseded(aid, timestamp):
+    assess = {"id": aid, "assessor": "Self", "role": "Product Designer", "scores": {"Craft": 3}, "status": "Superseded"}
+    if timestamp:
+        assess["timestamp"] = timestamp
+    return assess
+
+def test_archive_rolls_up_only_dated_superseded_records(repo):
+    storage.save_data({"ann": [superseded("old", "2024-01-15T00:00:00"), superseded("undated", None)]}, repo.data_file)
+    result = retention.archive(repo, now=datetime(2025, 1, 1))
+    assert result["archived"] == 2
+    assert not repo.user_assessments("ann")
+    assert "assessments-undated.jsonl.gz" in result["segments"]
+    rollup = storage.load_data(retention.rollup_file(repo.archive_dir))
+    assert list(rollup["user"]["ann"]["month"]) == ["2024-01"]
+    assert os.path.exists(os.path.join(repo.archive_dir, "assessments-undated.jsonl.gz"))
@@ -0,0 +1,97 @@
+import random
+import threading
+import pytest
+import storage
+
+pytest.importorskip("numpy")
+import aggregates
+from constants import CRITERIA_NAMES, ROLES, TOMO_COMPONENTS, tomo_total
+from repository import VIEW_MODULES, JsonRepository, SqliteRepository
+
+USERS = {"sadmin": {"password": "x", "role": "Superadmin"},
+         **{f"u{i}": {"password": "x", "role": "User", "title": ROLES[i % len(ROLES)]} for i in range(6)}}
+MONTHS = ["2024-11", "2024-12", "2025-01", "2025-02", "2025-04"]
+
+@pytest.fixture
+def repos(tmp_path):
+    users = str(tmp_path / "users.json")
+    storage.save_data(USERS, users)
+    sqlite = SqliteRepository(str(tmp_path / "test.db"), str(tmp_path / "archive"))
+    sqlite.save_users(USERS)
+    return JsonRepository(str(tmp_path / "data.json"), users, str(tmp_path / "archive")), sqlite
+
+def random_op(rnd, i, existing):
+    user = rnd.choice([u for u in USERS if u != "sadmin"])
+    ids = existing.get(user, [])
+    if ids and rnd.random() < 0.5:
+        return {"op": rnd.choice(["approve", "approve", "reject", "delete"]), "user": user, "id": rnd.choice(ids)}
+    role = rnd.choice(ROLES)
+    assess = {"id": rnd.choice(ids) if ids and rnd.random() < 0.05 else f"a{i}",
+              "assessor": rnd.choice(["Self", "Self", "Peer", "Manager"]), "role": role,
+              "scores": {crit: rnd.randint(1, 5) for crit in CRITERIA_NAMES[role]},
+              "timestamp": f"{rnd.choice(MONTHS)}-1{rnd.randint(0, 9)}T10:00:00",
+              "status": rnd.choice(["Pending Approval", "Approved"])}
+    if rnd.random() < 0.7:
+        assess["tomo_scores"] = {comp: rnd.randint(1, 7) for comp in TOMO_COMPONENTS}
+        assess["tomo"] = tomo_total(assess["tomo_scores"])
+    return {"op": "add", "user": user, "assessment": assess}
+
+def reads(repo):
+    users = [u for u in USERS if u != "sadmin"]
+    return {
+        "assessments": {u: [(a["id"], a.get("status")) for a in repo.user_assessments(u)] for u in users},
+        "status_counts": repo.status_counts(),
+        "user_status_counts": {u: repo.user_status_counts(u) for u in users},
+        "aggregates": {u: aggregates.normalize(repo.user_aggregate(u)) if repo.user_aggregate(u) else None for u in users},
+        "history": {(scope, key, period): repo.history(scope, key, period)
+                    for scope, keys in (("user", users), ("role", ROLES)) for key in keys for period in ("month", "quarter")},
+        "tomo": {"org": repo.tomo_histograms("org").tolist(),
+                 **{(scope, key): counts.tolist() for scope in ("user", "role")
+                    for key, counts in repo.tomo_histograms(scope).items()}},
+    }
+
+def test_incremental_maintenance_matches_the_json_backend(repos):
+    json_repo, sqlite = repos
+    rnd = random.Random(5)
+    existing = {}
+    for i in range(400):
+        op = random_op(rnd, i, existing)
+        results = [repo.commit([op]) for repo in repos]
+        assert results[0] == results[1], op
+        if op["op"] == "add" and results[0][0][0]:
+            existing.setdefault(op["user"], []).append(op["assessment"]["id"])
+        elif op["op"] == "delete" and results[0][0][0]:
+            existing[op["user"]].remove(op["id"])
+        if i % 50 == 49:
+            assert reads(sqlite) == reads(json_repo)
+    assert any(a.get("status") == "Superseded" for _, a in json_repo.iter_assessments())
+    assert {name: sqlite.verify(name) for name in VIEW_MODULES} == dict.fromkeys(VIEW_MODULES, [])
+
+def test_rebuild_repairs_drifted_tables(repos):
+    json_repo, sqlite = repos
+    rnd = random.Random(9)
+    existing = {}
+    for i in range(150):
+        op = random_op(rnd, i, existing)
+        for repo in repos:
+            repo.commit([op])
+        if op["op"] == "add":
+            existing.setdefault(op["user"], []).append(op["assessment"]["id"])
+    with sqlite.conn:
+        sqlite.conn.execute("UPDATE user_scores SET total = total + 1 WHERE rowid = (SELECT MIN(rowid) FROM user_scores)")
+        sqlite.conn.execute("DELETE FROM history WHERE rowid = (SELECT MIN(rowid) FROM history)")
+        sqlite.conn.execute("UPDATE tomo_bins SET count = count + 2 WHERE rowid = (SELECT MIN(rowid) FROM tomo_bins)")
+    assert all(sqlite.verify(name) for name in VIEW_MODULES)
+    for name in VIEW_MODULES:
+        sqlite.rebuild(name)
+    assert {name: sqlite.verify(name) for name in VIEW_MODULES} == dict.fromkeys(VIEW_MODULES, [])
+    assert reads(sqlite) == reads(json_repo)
+
+def test_threads_reuse_pooled_connections(repos):
+    _, sqlite = repos
+    seen = []
+    for _ in range(5):
+        thread = threading.Thread(target=lambda: seen.append(id(sqlite.conn)) or sqlite.load_users())
+        thread.start()
+        thread.join()
+    assert len(set(seen)) == 1
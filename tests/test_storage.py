@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import pytest
+import storage
+from storage import assessment_id
+
+def assessment(aid, status="Pending Approval", assessor="Peer"):
+    return {"id": aid, "assessor": assessor, "role": "Product Designer", "scores": {"Craft": 3},
+            "timestamp": "2025-01-01T00:00:00", "status": status}
+
+def add(user, aid, **kwargs):
+    return {"op": "add", "user": user, "assessment": assessment(aid, **kwargs)}
+
+def ids(data, user):
+    return [assessment_id(a) for a in data.get(user, ())]
+
+@pytest.fixture
+def data_file(tmp_path):
+    file = str(tmp_path / "assessments.json")
+    storage.save_data({}, file)
+    return file
+
+def test_journaled_ops_replay_over_snapshot(data_file):
+    storage.commit(data_file, [add("ann", "a1"), add("ann", "a2")])
+    storage.commit(data_file, [{"op": "approve", "user": "ann", "id": "a1"}])
+    assert os.path.exists(storage.journal_path(data_file))
+    data = storage.read_data(data_file)
+    assert ids(data, "ann") == ["a1", "a2"]
+    assert data["ann"][0]["status"] == "Approved"
+
+def test_torn_last_line_is_ignored(data_file):
+    storage.commit(data_file, [add("ann", "a1")])
+    with open(storage.journal_path(data_file), 'a') as f:
+        f.write(json.dumps(add("ann", "a2"))[:20])
+    assert ids(storage.read_data(data_file), "ann") == ["a1"]
+
+def test_replay_of_ops_already_in_snapshot_is_idempotent(data_file):
+    ops = [add("ann", "a1"), add("ann", "a2"), {"op": "approve", "user": "ann", "id": "a1"},
+           {"op": "delete", "user": "ann", "id": "a2"}]
+    storage.commit(data_file, ops)
+    # A compaction that wrote the snapshot but died before removing the
+    # compacting journal leaves every op in both places
+    folded = storage.read_data(data_file)
+    os.replace(storage.journal_path(data_file), storage.compacting_path(data_file))
+    storage.atomic_write(data_file, json.dumps(folded))
+    storage.invalidate(data_file)
+    assert storage.read_data(data_file) == folded
+    storage.compact(data_file)
+    assert not os.path.exists(storage.compacting_path(data_file))
+    assert storage.load_snapshot(data_file) == folded
+
+def test_compaction_folds_journal_into_snapshot(data_file):
+    storage.commit(data_file, [add("ann", "a1"), add("bob", "b1")])
+    expected = storage.read_data(data_file)
+    storage.compact(data_file)
+    assert not os.path.exists(storage.journal_path(data_file))
+    assert not os.path.exists(storage.compacting_path(data_file))
+    assert storage.load_snapshot(data_file) == expected
+    assert storage.thaw(storage.load_data(data_file)) == expected
+
+def test_read_racing_compaction_sees_compacted_ops(data_file, monkeypatch):
+    storage.commit(data_file, [add("ann", "a1"), add("ann", "a2")])
+    real_load_snapshot = storage.load_snapshot
+    raced = []
+
+    def load_then_compact(file):
+        data = real_load_snapshot(file)
+        if not raced:
+            # The compaction lands after the reader has the old snapshot
+            raced.append(True)
+            storage.compact(data_file)
+        return data
+    monkeypatch.setattr(storage, "load_snapshot", load_then_compact)
+    assert ids(storage.read_data(data_file), "ann") == ["a1", "a2"]
+    assert raced
+
+def test_writers_racing_compaction_lose_nothing(data_file):
+    writers, per_writer = 4, 50
+    done = threading.Event()
+
+    def write(n):
+        for i in range(per_writer):
+            storage.commit(data_file, [add(f"user{n}", f"{n}-{i}")])
+
+    def compact_loop():
+        while not done.is_set():
+            storage.compact(data_file)
+
+    compactor = threading.Thread(target=compact_loop)
+    compactor.start()
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    done.set()
+    compactor.join()
+    data = storage.read_data(data_file)
+    for n in range(writers):
+        assert ids(data, f"user{n}") == [f"{n}-{i}" for i in range(per_writer)]
+    assert storage.thaw(storage.load_data(data_file)) == data
+
+def test_commit_reports_conflicts(data_file):
+    storage.commit(data_file, [add("ann", "a1"), add("ann", "self", assessor="Self")])
+    results = storage.commit(data_file, [
+        {"op": "approve", "user": "ann", "id": "a1"},
+        {"op": "approve", "user": "ann", "id": "a1"},
+        {"op": "reject", "user": "ann", "id": "missing"},
+        add("ann", "a1"),
+        {"op": "dedupe", "user": "ann", "id": "a1"},
+        {"op": "delete", "user": "ann", "id": "self"},
+    ])
+    assert results == [(True, "Approved"), (False, "Already Approved"), (False, "Not found"),
+                       (False, "Already submitted"), (False, "No duplicates"), (True, "Deleted")]
+    # Only the ops that took effect are journaled
+    with open(storage.journal_path(data_file)) as f:
+        assert sum(1 for _ in f) == 2 + 2
+
+def test_stale_save_raises_version_conflict(data_file):
+    data, version = storage.load_versioned(data_file)
+    storage.save_data({"ann": [assessment("a1")]}, data_file, expected_version=version)
+    with pytest.raises(storage.VersionConflict):
+        storage.save_data({}, data_file, expected_version=version)
+    assert ids(storage.load_data(data_file), "ann") == ["a1"]
+
+def test_journaled_write_bumps_version(data_file):
+    _, version = storage.load_versioned(data_file)
+    storage.commit(data_file, [add("ann", "a1")])
+    _, after = storage.load_versioned(data_file)
+    assert after != version
+    with pytest.raises(storage.VersionConflict):
+        storage.save_data({}, data_file, expected_version=version)
+
+def test_view_built_across_a_write_is_not_kept(data_file, monkeypatch):
+    import aggregates
+    storage.commit(data_file, [add("ann", "a1"), add("ann", "a2")])
+    storage.commit(data_file, [{"op": "approve", "user": "ann", "id": "a1"}])
+    storage.load_data(data_file)
+    build, update = storage._views["aggregates"]
+    started, release = threading.Event(), threading.Event()
+
+    def slow_build(data):
+        state = build(data)
+        started.set()
+        release.wait(5)
+        return state
+    monkeypatch.setitem(storage._views, "aggregates", (slow_build, update))
+    reader = threading.Thread(target=storage.load_view, args=(data_file, "aggregates"))
+    reader.start()
+    assert started.wait(5)
+    # The write patches the cache while the build above is still running
+    storage.commit(data_file, [{"op": "approve", "user": "ann", "id": "a2"}])
+    release.set()
+    reader.join()
+    assert storage.load_view(data_file, "aggregates")["ann"]["approved"] == 2
+    assert aggregates.diff(storage.load_view(data_file, "aggregates"),
+                           aggregates.build(storage.read_data(data_file))) == []
+
+def test_versioned_put_never_goes_backwards(data_file):
+    new = {"op": "put", "user": "ann", "version": 2, "value": {"counts": {"Approved": 2}, "version": 2}}
+    old = {"op": "put", "user": "ann", "version": 1, "value": {"counts": {"Approved": 1}, "version": 1}}
+    assert storage.commit(data_file, [new, old, new]) == [(True, "Updated"), (False, "Outdated"), (False, "Outdated")]
+    assert storage.read_data(data_file)["ann"]["counts"] == {"Approved": 2}
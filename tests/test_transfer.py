@@ -0,0 +1,65 @@
+import pytest
+import storage
+import transfer
+from constants import CRITERIA_NAMES, TOMO_COMPONENTS
+
+USERS = {"sadmin": {"role": "Superadmin"}, "ann": {"role": "User", "title": "Product Designer"}}
+
+def row(**fields):
+    values = {"user": "ann", "id": "a1", "assessor": "Peer", "role": "Product Designer",
+              "timestamp": "2025-01-05T10:00:00"}
+    values.update({crit: "3" for crit in CRITERIA_NAMES["Product Designer"]})
+    values.update(fields)
+    return values
+
+def test_parse_row_reads_a_csv_row():
+    user, assess = transfer.parse_row(row(assessor_name="Bo", status=""), USERS)
+    assert user == "ann"
+    assert assess == {"id": "a1", "assessor": "Peer", "assessor_name": "Bo", "role": "Product Designer",
+                      "scores": dict.fromkeys(CRITERIA_NAMES["Product Designer"], 3),
+                      "timestamp": "2025-01-05T10:00:00", "status": "Approved"}
+
+@pytest.mark.parametrize("timestamp, stored", [
+    ("2025-01-05", "2025-01-05T00:00:00"),
+    ("2025-01-05 10:00", "2025-01-05T10:00:00"),
+    ("2025-01-05T10:00:00.500000", "2025-01-05T10:00:00.500000"),
+])
+def test_parse_row_stores_timestamps_as_the_app_writes_them(timestamp, stored):
+    assert transfer.parse_row(row(timestamp=timestamp), USERS)[1]["timestamp"] == stored
+
+@pytest.mark.parametrize("timestamp", ["2024-W01-1", "20240105", "2024-13-01", "", None, 20240105, "yesterday"])
+def test_parse_row_rejects_timestamps_history_cant_bucket(timestamp):
+    with pytest.raises(ValueError, match="timestamp"):
+        transfer.parse_row(row(timestamp=timestamp), USERS)
+
+@pytest.mark.parametrize("fields, message", [
+    ({"user": "sadmin"}, "unknown user"),
+    ({"user": "zed"}, "unknown user"),
+    ({"role": "Astronaut"}, "unknown role"),
+    ({"assessor": "Boss"}, "unknown assessor"),
+    ({"status": "Maybe"}, "unknown status"),
+    ({"Design Craft": "6"}, "between 1 and 5"),
+    ({"Design Craft": "2.5"}, "whole number"),
+    ({"Design Craft": ""}, "whole number"),
+    ({"tomo_play": "3"}, "all present or all blank"),
+])
+def test_parse_row_rejects_invalid_rows(fields, message):
+    with pytest.raises(ValueError, match=message):
+        transfer.parse_row(row(**fields), USERS)
+
+def test_parse_row_checks_tomo_against_its_components():
+    tomo = {f"tomo_{comp}": "4" for comp in TOMO_COMPONENTS}
+    assert transfer.parse_row(row(**tomo, tomo="0"), USERS)[1]["tomo"] == 0
+    with pytest.raises(ValueError, match="doesn't match"):
+        transfer.parse_row(row(**tomo, tomo="5"), USERS)
+
+def test_import_reports_bad_timestamps_without_writing_them(tmp_path):
+    pytest.importorskip("numpy")
+    from repository import JsonRepository
+    users = str(tmp_path / "users.json")
+    storage.save_data(USERS, users)
+    repo = JsonRepository(str(tmp_path / "data.json"), users, str(tmp_path / "archive"))
+    summary = transfer.import_rows(repo, [row(id="bad", timestamp="2024-W01-1"), row(id="good", timestamp="2025-01-05")])
+    assert summary == {"imported": 1, "skipped": 0, "errors": [(1, "timestamp must be an ISO 8601 date or date-time, got '2024-W01-1'")]}
+    assert [a["id"] for a in repo.user_assessments("ann")] == ["good"]
+    assert list(repo.history("user", "ann")) == ["2025-01"]
@@ -0,0 +1,215 @@
+import sys
+from collections import Counter
+import numpy as np
+import storage
+from aggregates import is_approved
+from constants import TOMO_COMPONENTS, TOMO_POSITIVE, TOMO_NEGATIVE
+from storage import assessment_id
+
+# Pre-binned ToMo histograms over approved assessments. A histogram is one
+# count vector: a bin per possible total, then a bin per score for each
+# component in TOMO_COMPONENTS order. Percentiles and means are read off the
+# bins, so they never touch the assessments themselves.
+SCORE_LOW, SCORE_HIGH = 1, 7
+SCORE_BINS = SCORE_HIGH - SCORE_LOW + 1
+TOTAL_LOW = len(TOMO_POSITIVE) * SCORE_LOW - len(TOMO_NEGATIVE) * SCORE_HIGH
+TOTAL_HIGH = len(TOMO_POSITIVE) * SCORE_HIGH - len(TOMO_NEGATIVE) * SCORE_LOW
+TOTAL_BINS = TOTAL_HIGH - TOTAL_LOW + 1
+WIDTH = TOTAL_BINS + len(TOMO_COMPONENTS) * SCORE_BINS
+COMPONENT_OFFSET = {comp: TOTAL_BINS + i * SCORE_BINS for i, comp in enumerate(TOMO_COMPONENTS)}
+
+def empty():
+    return np.zeros(WIDTH, dtype=np.int64)
+
+# Bin indexes one assessment counts towards; scores outside the scale are left out
+def bins(assess):
+    cols = []
+    total = assess.get('tomo')
+    if isinstance(total, int) and TOTAL_LOW <= total <= TOTAL_HIGH:
+        cols.append(total - TOTAL_LOW)
+    for comp, score in (assess.get('tomo_scores') or {}).items():
+        if comp in COMPONENT_OFFSET and isinstance(score, int) and SCORE_LOW <= score <= SCORE_HIGH:
+            cols.append(COMPONENT_OFFSET[comp] + score - SCORE_LOW)
+    return cols
+
+def _scopes(user, assess):
+    yield "user", user
+    if assess.get('role') is not None:
+        yield "role", assess['role']
+
+# Histograms per user, per role (the title recorded on the assessment) and for
+# the whole org: {"user": {user: counts}, "role": {role: counts}, "org": counts}
+def grouped(keys, cols):
+    if not keys:
+        return {}
+    names, codes = np.unique(np.asarray(keys), return_inverse=True)
+    counts = np.zeros((len(names), WIDTH), dtype=np.int64)
+    np.add.at(counts, (codes, np.asarray(cols, dtype=np.intp)), 1)
+    return {name: counts[i] for i, name in enumerate(names.tolist())}
+
+def build(data):
+    # Flattened to one (key, bin) pair per counted score, then binned in bulk
+    users, user_cols, roles, role_cols = [], [], [], []
+    for user, assessments in data.items():
+        for assess in assessments:
+            if not is_approved(assess):
+                continue
+            cols = bins(assess)
+            users.extend([user] * len(cols))
+            user_cols.extend(cols)
+            if assess.get('role') is not None:
+                roles.extend([assess['role']] * len(cols))
+                role_cols.extend(cols)
+    return {"user": grouped(users, user_cols), "role": grouped(roles, role_cols),
+            "org": np.bincount(np.asarray(user_cols, dtype=np.intp), minlength=WIDTH).astype(np.int64)}
+
+# Views are shared with sessions that may be reading them, so every vector
+# touched is replaced rather than updated in place
+def _shift(state, scope, key, delta):
+    counts = state[scope].get(key, 0) + delta
+    if counts.any():
+        state[scope][key] = counts
+    else:
+        state[scope].pop(key, None)
+
+def add(state, user, assess, sign=1):
+    cols = bins(assess)
+    if not cols:
+        return
+    delta = sign * np.bincount(cols, minlength=WIDTH).astype(np.int64)
+    for scope, key in _scopes(user, assess):
+        _shift(state, scope, key, delta)
+    state["org"] = state["org"] + delta
+
+def update(state, user, before, after):
+    old = Counter(assessment_id(a) for a in before if is_approved(a))
+    new = Counter(assessment_id(a) for a in after if is_approved(a))
+    if old == new:
+        return
+    by_id = {assessment_id(a): a for a in (*before, *after)}
+    for aid, n in (old - new).items():
+        for _ in range(n):
+            add(state, user, by_id[aid], -1)
+    for aid, n in (new - old).items():
+        for _ in range(n):
+            add(state, user, by_id[aid])
+
+storage.register_view("tomo", build, update)
+
+# The sharded store keeps each user's histograms in their manifest entry as
+# {"user": bins, "role": {role: bins}}, with bins as {"index": count}, so the
+# org and role totals are summed from the manifest without opening a shard
+def to_sparse(counts):
+    return {str(i): int(counts[i]) for i in np.flatnonzero(counts)}
+
+def from_sparse(bins):
+    counts = empty()
+    for i, n in bins.items():
+        counts[int(i)] = n
+    return counts
+
+def user_bins(user, assessments):
+    state = build({user: assessments})
+    return {"user": to_sparse(state["user"].get(user, empty())),
+            "role": {role: to_sparse(counts) for role, counts in state["role"].items()}}
+
+def _add_entry(state, user, entry, sign):
+    stored = (entry or {}).get("tomo")
+    if not stored or not stored["user"]:
+        return
+    delta = sign * from_sparse(stored["user"])
+    _shift(state, "user", user, delta)
+    for role, role_bins in stored["role"].items():
+        _shift(state, "role", role, sign * from_sparse(role_bins))
+    state["org"] = state["org"] + delta
+
+def build_manifest(manifest):
+    state = {"user": {}, "role": {}, "org": empty()}
+    for user, entry in manifest.items():
+        _add_entry(state, user, entry, 1)
+    return state
+
+def update_manifest(state, user, before, after):
+    if (before or {}).get("tomo") == (after or {}).get("tomo"):
+        return
+    _add_entry(state, user, before, -1)
+    _add_entry(state, user, after, 1)
+
+storage.register_view("manifest_tomo", build_manifest, update_manifest)
+
+# scope is "org" (one histogram), "user" or "role" ({key: histogram}, all keys
+# when keys is None)
+def select(state, scope, keys=None):
+    if scope == "org":
+        return state["org"]
+    hists = state[scope]
+    return dict(hists) if keys is None else {k: hists[k] for k in keys if k in hists}
+
+def combine(histograms):
+    total = empty()
+    for counts in histograms:
+        total = total + counts
+    return total
+
+def totals(counts):
+    return counts[:TOTAL_BINS]
+
+def component(counts, comp):
+    start = COMPONENT_OFFSET[comp]
+    return counts[start:start + SCORE_BINS]
+
+def _values(hist, low):
+    return np.arange(low, low + len(hist))
+
+def distribution(hist, low=TOTAL_LOW):
+    return {int(v): int(n) for v, n in zip(_values(hist, low), hist)}
+
+def mean(hist, low=TOTAL_LOW):
+    n = hist.sum()
+    return float((hist * _values(hist, low)).sum() / n) if n else None
+
+# Nearest-rank percentiles, so every result is a score someone actually gave
+def percentiles(hist, qs=(25, 50, 75), low=TOTAL_LOW):
+    n = hist.sum()
+    if not n:
+        return {q: None for q in qs}
+    ranks = np.maximum(np.ceil(np.asarray(qs, dtype=float) / 100 * n), 1)
+    idx = np.searchsorted(np.cumsum(hist), ranks)
+    return {q: int(low + i) for q, i in zip(qs, idx)}
+
+# Where value falls in a distribution, 0-100, with ties counted as half below
+def percentile_rank(hist, value, low=TOTAL_LOW):
+    n = hist.sum()
+    if not n or value is None:
+        return None
+    values = _values(hist, low)
+    return float((hist[values < value].sum() + 0.5 * hist[values == value].sum()) / n * 100)
+
+def summary(counts):
+    hist = totals(counts)
+    p = percentiles(hist)
+    return {"count": int(hist.sum()), "mean": mean(hist), "p25": p[25], "median": p[50], "p75": p[75],
+            "components": {comp: mean(component(counts, comp), SCORE_LOW) for comp in TOMO_COMPONENTS}}
+
+# A team against the org: its summary plus where its mean total sits among
+# every approved assessment in the org
+def team_summary(repo, members):
+    team = combine(repo.tomo_histograms("user", members).values())
+    result = summary(team)
+    result["org_percentile"] = percentile_rank(totals(repo.tomo_histograms("org")), result["mean"])
+    return result
+
+def flatten(state):
+    flat = {("org", None): state["org"].tolist()}
+    for scope in ("user", "role"):
+        flat.update({(scope, key): counts.tolist() for key, counts in state[scope].items()})
+    return {key: counts for key, counts in flat.items() if any(counts)}
+
+def diff(stored, expected):
+    return [(key, stored.get(key), expected.get(key)) for key in sorted(set(stored) | set(expected), key=str)
+            if stored.get(key) != expected.get(key)]
+
+if __name__ == "__main__":
+    # python tomo.py verify|rebuild
+    from repository import view_cli
+    view_cli("tomo", sys.argv)
@@ -0,0 +1,206 @@
+import csv
+import os
+import re
+import sys
+from datetime import datetime
+from constants import ROLES, CRITERIA_NAMES, ALL_CRITERIA, TOMO_COMPONENTS, tomo_total
+from storage import assessment_id
+
+# Flat row layout shared by export and import, one column per criterion and
+# per ToMo component. Criteria a role doesn't use are left blank.
+BASE_COLUMNS = ("user", "id", "assessor", "assessor_name", "role", "status", "timestamp")
+TOMO_COLUMNS = tuple(f"tomo_{comp}" for comp in TOMO_COMPONENTS)
+COLUMNS = BASE_COLUMNS + ALL_CRITERIA + TOMO_COLUMNS + ("tomo",)
+
+ASSESSORS = ("Self", "Peer", "Manager")
+STATUSES = ("Approved", "Pending Approval", "Rejected", "Superseded")
+CHUNK_SIZE = 1000
+
+def flatten(user, assess):
+    row = dict.fromkeys(COLUMNS)
+    row.update(user=user, id=assessment_id(assess), assessor=assess.get('assessor'),
+               assessor_name=assess.get('assessor_name'), role=assess.get('role'),
+               status=assess.get('status', 'Approved'), timestamp=assess.get('timestamp'), tomo=assess.get('tomo'))
+    for crit, score in assess.get('scores', {}).items():
+        if crit in row:
+            row[crit] = score
+    for comp, score in assess.get('tomo_scores', {}).items():
+        if f"tomo_{comp}" in row:
+            row[f"tomo_{comp}"] = score
+    return row
+
+def iter_rows(repo):
+    for user, assess in repo.iter_assessments():
+        yield flatten(user, assess)
+
+def chunked(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+def parquet_schema(pa):
+    fields = [(name, pa.string()) for name in BASE_COLUMNS]
+    fields += [(name, pa.int64()) for name in ALL_CRITERIA + TOMO_COLUMNS + ("tomo",)]
+    return pa.schema(fields)
+
+def export(repo, path, fmt=None, size=CHUNK_SIZE):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".")
+    rows = 0
+    if fmt == "parquet":
+        pa = _pyarrow()
+        schema = parquet_schema(pa)
+        with pa.parquet.ParquetWriter(path, schema) as writer:
+            for chunk in chunked(iter_rows(repo), size):
+                writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=schema))
+                rows += len(chunk)
+    elif fmt == "csv":
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            for chunk in chunked(iter_rows(repo), size):
+                writer.writerows(chunk)
+                rows += len(chunk)
+    else:
+        raise ValueError(f"Unknown export format {fmt!r}, expected csv or parquet")
+    return rows
+
+def read_csv_rows(f):
+    yield from csv.DictReader(f)
+
+def read_parquet_rows(source, size=CHUNK_SIZE):
+    pa = _pyarrow()
+    for batch in pa.parquet.ParquetFile(source).iter_batches(batch_size=size):
+        yield from batch.to_pylist()
+
+def _blank(value):
+    return value is None or value == ""
+
+def _score(row, column, low, high):
+    value = row.get(column)
+    # Spreadsheets and pandas often write whole numbers as "3.0"
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    if number is None or not number.is_integer():
+        raise ValueError(f"{column} must be a whole number, got {value!r}")
+    score = int(number)
+    if not low <= score <= high:
+        raise ValueError(f"{column} must be between {low} and {high}, got {score}")
+    return score
+
+# Returns (user, assessment) for a flat row, or raises ValueError
+def parse_row(row, users):
+    user = row.get("user")
+    if user not in users or user == 'sadmin':
+        raise ValueError(f"unknown user {user!r}")
+    role = row.get("role")
+    if role not in ROLES:
+        raise ValueError(f"unknown role {role!r}")
+    assessor = row.get("assessor")
+    if assessor not in ASSESSORS:
+        raise ValueError(f"unknown assessor {assessor!r}")
+    status = row.get("status") or "Approved"
+    if status not in STATUSES:
+        raise ValueError(f"unknown status {status!r}")
+    # History and archive buckets slice the date out of the string, so only
+    # YYYY-MM-DD forms are taken, and they're stored as the app writes them
+    timestamp = row.get("timestamp")
+    try:
+        if not re.match(r"\d{4}-\d{2}-\d{2}(?:[T ]|$)", timestamp):
+            raise ValueError
+        timestamp = datetime.fromisoformat(timestamp).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"timestamp must be an ISO 8601 date or date-time, got {timestamp!r}")
+
+    scores = {crit: _score(row, crit, 1, 5) for crit in CRITERIA_NAMES[role]}
+    extra = [crit for crit in ALL_CRITERIA if crit not in scores and not _blank(row.get(crit))]
+    if extra:
+        raise ValueError(f"criteria not used by {role}: {', '.join(extra)}")
+
+    assess = {"assessor": assessor}
+    if not _blank(row.get("assessor_name")):
+        assess["assessor_name"] = row["assessor_name"]
+    assess.update({"role": role, "scores": scores})
+    given = [col for col in TOMO_COLUMNS if not _blank(row.get(col))]
+    if given:
+        if len(given) != len(TOMO_COLUMNS):
+            raise ValueError("ToMo components must be all present or all blank")
+        tomo_scores = {comp: _score(row, f"tomo_{comp}", 1, 7) for comp in TOMO_COMPONENTS}
+        tomo = tomo_total(tomo_scores)
+        if not _blank(row.get("tomo")) and _score(row, "tomo", -21, 21) != tomo:
+            raise ValueError(f"tomo {row['tomo']} doesn't match its components ({tomo})")
+        assess.update({"tomo": tomo, "tomo_scores": tomo_scores})
+    assess.update({"timestamp": timestamp, "status": status})
+    return user, {"id": row.get("id") or assessment_id(assess), **assess}
+
+def _ops(user, assess):
+    # An approved self assessment goes in pending and is then approved, so it
+    # replaces the user's current one the same way an approval in the app does
+    if assess["assessor"] == "Self" and assess["status"] == "Approved":
+        pending = dict(assess, status="Pending Approval")
+        return [{"op": "add", "user": user, "assessment": pending},
+                {"op": "approve", "user": user, "id": assess["id"]}]
+    return [{"op": "add", "user": user, "assessment": assess}]
+
+# Validates rows and commits the valid ones in batches. Rows already present
+# (same user and id) are skipped, so an import can be re-run safely.
+def import_rows(repo, rows, size=CHUNK_SIZE):
+    users = repo.load_users()
+    summary = {"imported": 0, "skipped": 0, "errors": []}
+    number = 0
+    for chunk in chunked(rows, size):
+        ops, firsts = [], []
+        for row in chunk:
+            number += 1
+            try:
+                user, assess = parse_row(row, users)
+            except ValueError as e:
+                summary["errors"].append((number, str(e)))
+                continue
+            firsts.append(len(ops))
+            ops.extend(_ops(user, assess))
+        if not ops:
+            continue
+        results = repo.commit(ops)
+        for i in firsts:
+            summary["imported" if results[i][0] else "skipped"] += 1
+    return summary
+
+def import_file(repo, path, fmt=None, size=CHUNK_SIZE):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".")
+    if fmt == "parquet":
+        return import_rows(repo, read_parquet_rows(path, size), size)
+    if fmt == "csv":
+        with open(path, newline='') as f:
+            return import_rows(repo, read_csv_rows(f), size)
+    raise ValueError(f"Unknown import format {fmt!r}, expected csv or parquet")
+
+if __name__ == "__main__":
+    # python transfer.py export|import <file.csv|file.parquet>
+    from repository import get_repository
+    if len(sys.argv) != 3 or sys.argv[1] not in ("export", "import"):
+        print("usage: python transfer.py export|import <file.csv|file.parquet>")
+        sys.exit(1)
+    repo = get_repository()
+    if sys.argv[1] == "export":
+        print(f"Exported {export(repo, sys.argv[2])} assessments to {sys.argv[2]}")
+    else:
+        summary = import_file(repo, sys.argv[2])
+        for number, error in summary["errors"]:
+            print(f"row {number}: {error}")
+        print(f"Imported {summary['imported']}, skipped {summary['skipped']} already present, "
+              f"rejected {len(summary['errors'])} invalid row(s)")